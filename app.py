@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, abort
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, render_template, redirect, url_for, session, abort, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
 from google.oauth2.credentials import Credentials
@@ -9,27 +9,29 @@ import json
 import datetime
 import requests
 import logging
+import threading
 from logging.handlers import RotatingFileHandler
-from chatbot.data_processing import preprocess_text, vectorizer, tfidf_matrix
-from chatbot.chatbot_logic import get_response, save_new_question
-from chatbot.database import db, User, ChatSession, ChatMessage, SharedChat
+from chatbot.chatbot_logic import get_response, get_responses, save_new_question, stream_response, external_response
+from chatbot.chatbot_logic import question_store, apply_rating, snapshots, reload_knowledge
+from chatbot.chatbot_logic import start_worker as start_chatbot_worker
+from chatbot.config import BATCH_MAX_QUERIES, ADMIN_TOKEN, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, SESSIONS_PAGE_SIZE
+from chatbot.config import SQLITE_PRAGMAS, CHAT_WRITE_BEHIND, SHARED_PAGE_CACHE_SIZE, SHARED_METRICS
+from chatbot.config import LOADTEST_LOGIN, LOADTEST_EMAIL_DOMAIN
+from chatbot.database import db, User, ChatSession, ChatMessage, SharedChat, add_message, upgrade_schema, set_sqlite_pragmas
+from chatbot.chat_writer import ChatWriter, unflushed, message_dict
+from chatbot.page_cache import PageCache
+from chatbot.metrics import render as render_metrics, share_metrics
+from werkzeug.http import is_resource_modified
 import secrets
 
 # Allow OAuth2 to work with HTTP in development
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chatbot.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize database
-db.init_app(app)
+bp = Blueprint('main', __name__)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
@@ -58,15 +60,17 @@ console_handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.addHandler(console_handler)
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+# In write-behind mode chat messages are committed in batches by a background thread, see start_worker
+chat_writer = None
+
+# Rendered shared-chat pages, by share token and session version
+shared_pages = PageCache(SHARED_PAGE_CACHE_SIZE)
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-@app.route('/login')
+@bp.route('/login')
 def login():
     """Initiate Google OAuth login."""
     logger.info("Starting OAuth login process")
@@ -104,7 +108,7 @@ def login():
         logger.error(f"Error in login route: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/auth/callback')
+@bp.route('/auth/callback')
 def auth_callback():
     """Handle Google OAuth callback."""
     logger.info("Received OAuth callback")
@@ -153,96 +157,224 @@ def auth_callback():
 
         login_user(user)
         logger.info(f"Successfully logged in user: {email}")
-        return redirect(url_for('chat'))
+        return redirect(url_for('main.chat'))
         
     except Exception as e:
         logger.error(f"Error in auth_callback: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/logout')
+if LOADTEST_LOGIN:
+    @bp.route('/loadtest/login', methods=['POST'])
+    def loadtest_login():
+        """Log in a load-test user without Google, only enabled by LOADTEST_LOGIN."""
+        email = (request.get_json(silent=True) or {}).get('email', '')
+        if not email.endswith('@' + LOADTEST_EMAIL_DOMAIN):
+            abort(403)
+        user = User.query.filter_by(email=email).first()
+        if not user:
+            user = User(email=email, name=email.split('@')[0])
+            db.session.add(user)
+            db.session.commit()
+        login_user(user)
+        return jsonify({'status': 'success', 'user_id': user.id})
+
+    logger.warning("Load-test login enabled at /loadtest/login")
+
+@bp.route('/logout')
 @login_required
 def logout():
     """Log out the current user."""
     # Clear all session data
     session.clear()
     logout_user()
-    return redirect(url_for('chat'))
+    return redirect(url_for('main.chat'))
+
+def get_current_session(session_id):
+    """Return the user's session session_id, or their latest one, creating it if they have none."""
+    if session_id:
+        return ChatSession.query.filter_by(id=int(session_id), user_id=current_user.id).first()
+    # Get the most recent session or create a new one if none exists
+    current_session = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.id.desc()).first()
+    if not current_session:
+        current_session = ChatSession(
+            user_id=current_user.id,
+            date=datetime.datetime.now()
+        )
+        db.session.add(current_session)
+        db.session.commit()
+    return current_session
 
-@app.route('/', methods=['GET', 'POST'])
+def save_message(session_id, user_message, response, timestamp):
+    """Commit a chat message, or queue it in write-behind mode."""
+    shared_pages.invalidate(session_id)
+    if chat_writer:
+        chat_writer.add(session_id, user_message, response, timestamp)
+    else:
+        add_message(session_id, user_message, response, timestamp)
+        db.session.commit()
+
+def message_page(session_id, before=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """One page of a session's messages next to a message id cursor, oldest first.
+
+    Without `after` the page ends right before `before`, or at the latest
+    message. Returns (messages, has_more), has_more telling whether messages
+    exist beyond the page in the direction read. Messages still queued by
+    the write-behind writer are the latest ones, without an id until committed.
+    """
+    # Read before the query, see ChatWriter.pending
+    pending = chat_writer.pending(session_id) if chat_writer and before is None else []
+    query = ChatMessage.query.filter_by(session_id=session_id)
+    if after is not None:
+        rows = query.filter(ChatMessage.id > after).order_by(ChatMessage.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        if before is not None:
+            query = query.filter(ChatMessage.id < before)
+        rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+    messages = [message.to_dict() for message in rows]
+    if pending and not (after is not None and has_more):
+        messages += map(message_dict, unflushed(pending, {row.id for row in rows}))
+        if len(messages) > limit:
+            messages = messages[:limit] if after is not None else messages[-limit:]
+            has_more = True
+    return messages, has_more
+
+@bp.route('/', methods=['GET', 'POST'])
 def chat():
     """Handle chat interface and user input."""
     if not current_user.is_authenticated:
         return render_template('chat.html', chat_history=[], session_id=None)
 
-    session_id = request.args.get('session_id')
-    if session_id:
-        current_session = ChatSession.query.filter_by(id=int(session_id), user_id=current_user.id).first()
-    else:
-        # Get the most recent session or create a new one if none exists
-        current_session = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.id.desc()).first()
-        if not current_session:
-            current_session = ChatSession(
-                user_id=current_user.id,
-                date=datetime.datetime.now().isoformat()
-            )
-            db.session.add(current_session)
-            db.session.commit()
+    current_session = get_current_session(request.args.get('session_id'))
 
-    # Preprocess chat history to parse bot_response
-    chat_history = current_session.messages if current_session else []
-    processed_history = []
-    for msg in chat_history:
-        try:
-            processed_msg = {
-                'user_message': msg.user_message,
-                'bot_response': json.loads(msg.bot_response),
-                'timestamp': msg.timestamp
-            }
-            processed_history.append(processed_msg)
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing bot_response for message ID {msg.id}: {e}")
-            continue
-
-    if request.method == 'POST' and current_user.is_authenticated:
+    if request.method == 'POST' and current_session:
         user_input = request.form.get('message')
         if user_input:
             response = get_response(user_input, current_user.id)
-            timestamp = datetime.datetime.now().isoformat()
-
-            chat_entry = ChatMessage(
-                session_id=current_session.id,
-                user_message=user_input,
-                bot_response=json.dumps(response),
-                timestamp=timestamp
-            )
-            db.session.add(chat_entry)
-            db.session.commit()
+            save_message(current_session.id, user_input, response, datetime.datetime.now())
 
-            # Save to new_questions.json if similarity is low and not a shortcut
-            if response['similarity'] < 0.8 and not response.get('is_shortcut', False):
+            # Save the question if similarity is low and not a shortcut, nor a fallback for an unavailable API
+            if response['similarity'] < 0.8 and not response.get('is_shortcut', False) and not response.get('degraded'):
                 save_new_question(user_input, response['answer'], user_id=current_user.id)
 
-            processed_history = []
-            for msg in current_session.messages:
-                try:
-                    processed_msg = {
-                        'user_message': msg.user_message,
-                        'bot_response': json.loads(msg.bot_response),
-                        'timestamp': msg.timestamp
-                    }
-                    processed_history.append(processed_msg)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing bot_response for message ID {msg.id}: {e}")
-                    continue
-
-    return render_template('chat.html', chat_history=processed_history, session_id=current_session.id if current_session else None)
-
-@app.route('/about')
+    # Only the latest page is rendered, older messages are fetched on scroll
+    chat_history, has_more_history = message_page(current_session.id) if current_session else ([], False)
+    return render_template('chat.html', chat_history=chat_history, has_more_history=has_more_history,
+                           session_id=current_session.id if current_session else None)
+
+@bp.route('/api/sessions/<int:session_id>/messages', methods=['GET'])
+@login_required
+def api_session_messages(session_id):
+    """Page through the messages of a session with a message id cursor."""
+    if not ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first():
+        return jsonify({'status': 'error', 'message': 'Session not found'}), 404
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    if before is not None and after is not None:
+        return jsonify({'status': 'error', 'message': 'Use either before or after, not both'}), 400
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+    messages, has_more = message_page(session_id, before=before, after=after, limit=limit)
+    return jsonify({'status': 'success', 'messages': messages, 'has_more': has_more})
+
+def sse_event(event, data):
+    """Format one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@bp.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Answer a message over Server-Sent Events, streaming external answers token by token."""
+    user_input = (request.form.get('message') or '').strip()
+    if not user_input:
+        return jsonify({'status': 'error', 'message': 'Empty message'}), 400
+    session_id = request.args.get('session_id')
+    if session_id and not session_id.isdigit():
+        session_id = None
+    current_session = get_current_session(session_id)
+    if not current_session:
+        return jsonify({'status': 'error', 'message': 'Session not found'}), 404
+    user_id = current_user.id
+    chat_session_id = current_session.id
+
+    def persist(response):
+        timestamp = datetime.datetime.now()
+        save_message(chat_session_id, user_input, response, timestamp)
+        # A truncated answer stays in the history but must not come back as an exact match
+        if response['similarity'] < 0.8 and not response.get('is_shortcut', False) and not response.get('degraded') \
+                and not response.get('incomplete'):
+            save_new_question(user_input, response['answer'], user_id=user_id)
+        return timestamp.isoformat()
+
+    def generate():
+        tokens = []
+        response = None
+        try:
+            for kind, payload in stream_response(user_input, user_id):
+                if kind == 'token':
+                    tokens.append(payload)
+                    yield sse_event('token', {'text': payload})
+                else:
+                    response = payload
+            timestamp = persist(response)
+            yield sse_event('done', {'response': response, 'timestamp': timestamp, 'session_id': chat_session_id})
+        except GeneratorExit:
+            # The browser went away mid-answer, keep what was streamed so far
+            if response is None and tokens:
+                partial = external_response(''.join(tokens).strip())
+                partial['incomplete'] = True
+                persist(partial)
+            raise
+        except Exception as e:
+            logger.error(f"Error in chat_stream: {str(e)}", exc_info=True)
+            yield sse_event('error', {'message': 'Erreur lors de la génération de la réponse.'})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/api/chat/batch', methods=['POST'])
+@login_required
+def api_chat_batch():
+    """Answer a list of questions in one call, without saving them to a session."""
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'status': 'error', 'message': 'queries must be a list of non-empty strings'}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({'status': 'error', 'message': f'At most {BATCH_MAX_QUERIES} queries per batch'}), 413
+    allow_external = bool(data.get('allow_external', True))
+    responses = get_responses(queries, current_user.id, allow_external=allow_external)
+    return jsonify({'status': 'success', 'responses': responses})
+
+def _reload_knowledge(rebuild):
+    try:
+        reload_knowledge(rebuild=rebuild)
+    except Exception as e:
+        logger.error(f"Error reloading the knowledge base: {str(e)}", exc_info=True)
+
+@bp.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """Swap in the latest knowledge-base artifacts in the background, without a restart."""
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not secrets.compare_digest(token, ADMIN_TOKEN):
+        abort(403)
+    rebuild = bool((request.get_json(silent=True) or {}).get('rebuild', False))
+    threading.Thread(target=_reload_knowledge, args=(rebuild,), name="kb-reload", daemon=True).start()
+    return jsonify({'status': 'accepted', 'version': snapshots.current.version}), 202
+
+@bp.route('/metrics')
+def metrics():
+    """Stage latencies and hit counts of the answer cascade, in the Prometheus text format."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/about')
 def about():
     """Render about page."""
     return render_template('about.html')
 
-@app.route('/rate', methods=['POST'])
+@bp.route('/rate', methods=['POST'])
 @login_required
 def rate_response():
     try:
@@ -255,143 +387,44 @@ def rate_response():
         response = data['response']
 
         if rating == 1:  # Positive rating
-            # Save to data.json
-            if not save_to_data_json(question, response):
-                return jsonify({'status': 'error', 'message': 'Failed to save to data.json'}), 500
-            # Remove from new_questions.json if it exists
+            # Logged for every process, folded into data.json by the next build
+            apply_rating(question, response, positive=True, user_id=current_user.id)
+            # Remove from the saved questions if it exists
             remove_from_new_questions(question)
         else:  # Negative rating
-            # Remove from both data.json and new_questions.json
-            if not remove_from_data_json(question):
-                app.logger.warning(f"Failed to remove question from data.json: {question}")
+            # Remove from the knowledge base and the saved questions
+            if not apply_rating(question, response, positive=False, user_id=current_user.id):
+                current_app.logger.info(f"Question not in the knowledge base: {question}")
             if not remove_from_new_questions(question):
-                app.logger.warning(f"Failed to remove question from new_questions.json: {question}")
+                current_app.logger.warning(f"Failed to remove saved question: {question}")
 
         return jsonify({'status': 'success'})
     except Exception as e:
-        app.logger.error(f"Error in rate_response: {str(e)}")
+        current_app.logger.error(f"Error in rate_response: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def remove_from_data_json(question):
-    """Remove a question from data.json"""
-    try:
-        data_file = 'data/data.json'  # Fixed path to match save_to_data_json
-        if not os.path.exists(data_file):
-            app.logger.warning(f"data.json not found at {data_file}")
-            return False
-            
-        with open(data_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Filter out the question
-        original_length = len(data)
-        data = [entry for entry in data if entry['question'].lower() != question.lower()]
-        
-        if len(data) < original_length:
-            with open(data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            app.logger.info(f"Removed question from data.json: {question}")
-            return True
-        else:
-            app.logger.info(f"Question not found in data.json: {question}")
-            return False
-            
-    except Exception as e:
-        app.logger.error(f"Error removing from data.json: {str(e)}")
-        return False
-
-def save_to_data_json(question, response):
-    """Save positively rated Q&A to data.json."""
-    try:
-        data_file = 'data/data.json'
-        if not os.path.exists('data'):
-            os.makedirs('data')
-            
-        # Create or load existing data
-        if os.path.exists(data_file):
-            with open(data_file, 'r', encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                except json.JSONDecodeError:
-                    data = []
-        else:
-            data = []
-            
-        # Check if question already exists
-        for entry in data:
-            if entry['question'].lower() == question.lower():
-                # Update existing entry
-                entry['answer'] = response
-                entry['user_id'] = current_user.id
-                entry['timestamp'] = datetime.datetime.now().isoformat()
-                break
-        else:
-            # Add new entry if question doesn't exist
-            new_entry = {
-                "id": len(data) + 1,
-                "category": "user_rated",
-                "question": question,
-                "question_variations": [],
-                "answer": response,
-                "url": "",
-                "user_id": current_user.id,
-                "timestamp": datetime.datetime.now().isoformat()
-            }
-            data.append(new_entry)
-            
-        # Save updated data
-        with open(data_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            
-        return True
-    except Exception as e:
-        logger.error(f"Error saving to data.json: {str(e)}", exc_info=True)
-        return False
-
 def remove_from_new_questions(question):
-    """Remove negatively rated question from new_questions.json."""
+    """Remove a rated question from the saved questions of the current user."""
     try:
-        new_questions_file = 'data/new_questions.json'
-        if not os.path.exists(new_questions_file):
-            return True
-            
-        # Read all lines
-        with open(new_questions_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            
-        # Filter out the question
-        filtered_lines = []
-        for line in lines:
-            if line.strip():
-                try:
-                    entry = json.loads(line)
-                    if not (entry['question'].lower() == question.lower() and entry['user_id'] == current_user.id):
-                        filtered_lines.append(line)
-                except json.JSONDecodeError:
-                    continue
-                    
-        # Write back filtered content
-        with open(new_questions_file, 'w', encoding='utf-8') as f:
-            f.writelines(filtered_lines)
-            
+        question_store.remove(current_user.id, question)
         return True
     except Exception as e:
-        logger.error(f"Error removing from new_questions.json: {str(e)}", exc_info=True)
+        logger.error(f"Error removing saved question: {str(e)}", exc_info=True)
         return False
 
-@app.route('/new_chat', methods=['POST'])
+@bp.route('/new_chat', methods=['POST'])
 @login_required
 def new_chat():
     """Create a new chat session."""
     new_session = ChatSession(
         user_id=current_user.id,
-        date=datetime.datetime.now().isoformat()
+        date=datetime.datetime.now()
     )
     db.session.add(new_session)
     db.session.commit()
     return jsonify({"status": "success", "session_id": new_session.id})
 
-@app.route('/delete_chat', methods=['POST'])
+@bp.route('/delete_chat', methods=['POST'])
 @login_required
 def delete_chat():
     """Delete a chat session."""
@@ -401,40 +434,34 @@ def delete_chat():
     if session:
         db.session.delete(session)
         db.session.commit()
+        shared_pages.invalidate(session.id)
         return jsonify({"status": "success"})
     return jsonify({"status": "error", "message": "Session not found"}), 404
 
-@app.route('/get_sessions', methods=['GET'])
+@bp.route('/get_sessions', methods=['GET'])
 @login_required
 def get_sessions():
-    """Return all chat sessions for the current user, with a friendly name as title."""
-    import datetime
-    import calendar
-    sessions = ChatSession.query.filter_by(user_id=current_user.id).all()
-    result = []
-    for s in sessions:
-        # Use first user message if available and not empty
-        if s.messages and len(s.messages) > 0 and s.messages[0].user_message and s.messages[0].user_message.strip():
-            first_msg = s.messages[0].user_message.strip()
-            title = first_msg[:40] + ('...' if len(first_msg) > 40 else '')
-        else:
-            # Fallback: Chat_May09
-            try:
-                dt = datetime.datetime.fromisoformat(s.date)
-                month_name = dt.strftime('%b')  # e.g., 'May'
-                day = f"{dt.day:02d}"
-                title = f"Chat_{month_name}{day}"
-            except Exception:
-                title = "Nouveau chat"
-        result.append({
-            "id": s.id,
-            "date": s.date,
-            "title": title,
-            "messages": [{"user": m.user_message, "bot": json.loads(m.bot_response), "timestamp": m.timestamp} for m in s.messages]
-        })
-    return jsonify(result)
-
-@app.route('/api/share_chat/<int:session_id>', methods=['POST'])
+    """Return the summary of every chat session of the current user, without their messages."""
+    sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.id.desc()).all()
+    return jsonify([s.summary() for s in sessions])
+
+@bp.route('/api/sessions', methods=['GET'])
+@login_required
+def api_sessions():
+    """Page through the session summaries of the current user, newest first, with a session id cursor."""
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', SESSIONS_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+    query = ChatSession.query.filter_by(user_id=current_user.id)
+    if before is not None:
+        query = query.filter(ChatSession.id < before)
+    sessions = query.order_by(ChatSession.id.desc()).limit(limit + 1).all()
+    return jsonify({
+        'status': 'success',
+        'sessions': [s.summary() for s in sessions[:limit]],
+        'has_more': len(sessions) > limit
+    })
+
+@bp.route('/api/share_chat/<int:session_id>', methods=['POST'])
 @login_required
 def api_share_chat(session_id):
     session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
@@ -446,32 +473,78 @@ def api_share_chat(session_id):
         shared = SharedChat(token=token, session_id=session_id, created_at=datetime.datetime.now())
         db.session.add(shared)
         db.session.commit()
-    share_url = url_for('view_shared_chat', token=shared.token, _external=True)
+    share_url = url_for('main.view_shared_chat', token=shared.token, _external=True)
     return jsonify({'status': 'success', 'share_url': share_url})
 
-@app.route('/share/<token>')
+@bp.route('/share/<token>')
 def view_shared_chat(token):
-    shared = SharedChat.query.filter_by(token=token).first()
+    """Render a shared session (public, read-only), revalidated by its message count and last update."""
+    shared = db.session.execute(
+        db.select(ChatSession.id, ChatSession.message_count, ChatSession.date, ChatSession.updated_at)
+        .join(SharedChat, SharedChat.session_id == ChatSession.id)
+        .where(SharedChat.token == token)
+    ).first()
     if not shared:
         abort(404)
-    session = ChatSession.query.filter_by(id=shared.session_id).first()
-    if not session:
-        abort(404)
-    # Parse chat history for display (public, read-only)
-    chat_history = session.messages if session else []
-    processed_history = []
-    for msg in chat_history:
-        try:
-            processed_msg = {
-                'user_message': msg.user_message,
-                'bot_response': json.loads(msg.bot_response),
-                'timestamp': msg.timestamp
-            }
-            processed_history.append(processed_msg)
-        except Exception:
-            continue
-    return render_template('shared_chat.html', chat_history=processed_history)
+    session_id, message_count, date, updated_at = shared
+    # Stored in local time
+    last_modified = (updated_at or date).astimezone(datetime.timezone.utc)
+    version = f"{session_id}-{message_count}-{last_modified.timestamp():.6f}"
+    # Last-Modified only has whole seconds, a message added within the same one would be missed:
+    # revalidate on the exact ETag alone and ignore a bare If-Modified-Since
+    if request.if_none_match and not is_resource_modified(request.environ, etag=version):
+        response = Response(status=304)
+    else:
+        body = shared_pages.get(token, version)
+        if body is None:
+            messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.id.asc()).all()
+            body = render_template('shared_chat.html', chat_history=[msg.to_dict() for msg in messages])
+            shared_pages.put(token, version, body, group=session_id)
+        response = Response(body, mimetype='text/html')
+    response.set_etag(version)
+    response.last_modified = last_modified
+    # Browsers and proxies may keep the page but must revalidate it
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+def create_app(start=True):
+    """Build the app and create its database tables, then start_worker(app) unless start is False.
+
+    A pre-forking server builds it once before forking, with start=False,
+    and calls start_worker in each worker, see gunicorn.conf.py.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-secret-key')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chatbot.db'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+
+    # Create database tables
+    with app.app_context():
+        set_sqlite_pragmas(db.engine, SQLITE_PRAGMAS)
+        db.create_all()
+        upgrade_schema()
+    if start:
+        start_worker(app)
+    return app
+
+def start_worker(app):
+    """Open this process's own database connections and start its background threads."""
+    global chat_writer
+    with app.app_context():
+        # Pooled connections may come from the parent, leave them open for it
+        db.engine.dispose(close=False)
+    start_chatbot_worker()
+    if SHARED_METRICS["directory"]:
+        share_metrics(SHARED_METRICS["directory"], SHARED_METRICS["write_interval"])
+    if CHAT_WRITE_BEHIND["enabled"]:
+        chat_writer = ChatWriter(app, CHAT_WRITE_BEHIND["batch_size"], CHAT_WRITE_BEHIND["flush_interval"],
+                                 CHAT_WRITE_BEHIND["max_attempts"], CHAT_WRITE_BEHIND["dead_letter_path"])
+        chat_writer.start()
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))  # Updated port to 8080
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
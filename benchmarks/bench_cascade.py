@@ -0,0 +1,236 @@
+"""Benchmark the answer cascade on synthetic knowledge bases of several sizes.
+
+    python -m benchmarks.bench_cascade --sizes 1000 10000 100000 --output cascade.json
+
+For every size a data.json with question variations is generated in a
+scratch directory, and two fresh processes run there with the repo on their
+path, so the repo's own data, models and index are never touched:
+
+- "build" runs what python -m chatbot.train --build does, fitting the
+  artifacts and training the models, then fills the Whoosh index by
+  importing chatbot.data_processing, which serving alone never builds
+- "serve" times the imports of chatbot.data_processing and
+  chatbot.chatbot_logic on the published artifacts, then answers probe
+  queries with get_response and reports p50/p95/p99 latency per method
+
+The methods are those get_response answers with: shortcut, exact_match
+(saved questions), hybrid, index_search, answer_cache and External Chatbot,
+the latter against a local mock of the OpenRouter API. Probes are built so
+each method is reached, but every latency is filed under the method that
+actually answered: an off-topic probe close enough to an earlier one is
+answered by the answer cache. Peak RSS is read from each process.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = ["inscription", "scolarite", "vie_etudiante", "stages", "examens", "bibliotheque"]
+# Topic words are drawn from a vocabulary of pseudo-words, so entries differ by
+# more than a number and FastText learns spread-out vectors, as on real data
+SYLLABLES = ["ba", "ci", "do", "fe", "ga", "li", "mo", "nu", "pa", "ri", "so", "ta", "ve", "za", "lu",
+             "ner", "tor", "mar", "sel", "vin", "cor", "dal", "pen", "rou", "gen"]
+VOCABULARY_SIZE = 3000
+TEMPLATES = [
+    "Quelle est la {a} pour {b} et {c} numéro {n}?",
+    "Comment obtenir la {a} de {b} numéro {n}?",
+    "Où déposer la {a} pour le {b} {n}?",
+    "Quand commence la {a} du {b} {n}?",
+]
+INDEX_PROBES = ["commence", "déposer", "obtenir", "numéro", "Quand commence", "pour le"]
+VARIATIONS = [
+    "{a} {b} {c} {n}",
+    "Comment connaître la {a} de {b} {n}?",
+    "{b} {a} numéro {n} informations",
+]
+
+def vocabulary(rng, size, syllables=SYLLABLES):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def generate_kb(size, seed):
+    rng = random.Random(seed)
+    topics = vocabulary(rng, VOCABULARY_SIZE)
+    entries = []
+    for n in range(size):
+        a, b, c = rng.sample(topics, 3)
+        words = {"a": a, "b": b, "c": c, "n": n}
+        entries.append({
+            "id": n + 1,
+            "category": rng.choice(CATEGORIES),
+            "question": rng.choice(TEMPLATES).format(**words),
+            "question_variations": [v.format(**words) for v in rng.sample(VARIATIONS, 2)],
+            "answer": f"Réponse {n} concernant {a} {b}.",
+            "url": f"/fr/{b}/{n}" if n % 3 == 0 else "",
+            "file_path": ""
+        })
+    return entries
+
+class MockOpenRouter(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this delayed ACKs add 40 ms
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        body = json.dumps({"choices": [{"message": {"content": "Réponse générée par le mock."}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentiles(values):
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+    return {"n": len(values), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+def run_build():
+    from chatbot.artifacts import build_artifacts, load_artifacts
+    from chatbot.config import DATA_PATH, ARTIFACTS_DIR, TRAINED_MODELS_DIR
+    from chatbot.train import train_models
+    began = time.perf_counter()
+    build_artifacts(DATA_PATH, ARTIFACTS_DIR)
+    train_models(load_artifacts(ARTIFACTS_DIR), TRAINED_MODELS_DIR)
+    build_s = time.perf_counter() - began
+    began = time.perf_counter()
+    import chatbot.data_processing  # noqa: F401
+    return {"build_s": build_s, "index_s": time.perf_counter() - began, "peak_rss_mb": peak_rss_mb()}
+
+def run_serve(queries, seed):
+    began = time.perf_counter()
+    import chatbot.data_processing  # noqa: F401
+    data_processing_s = time.perf_counter() - began
+    began = time.perf_counter()
+    from chatbot import chatbot_logic
+    from chatbot.config import shortcuts
+    chatbot_logic_s = time.perf_counter() - began
+    startup_rss = peak_rss_mb()
+
+    rng = random.Random(seed)
+    entries = chatbot_logic.snapshots.current.knowledge_base.entries
+    sampled = rng.sample(range(len(entries)), min(queries, len(entries)))
+    user_id, other_user_id = 1, 2
+    saved = [f"question enregistrée {i} sans rapport" for i in range(queries)]
+    for question in saved:
+        chatbot_logic.question_store.save(user_id, question, f"réponse enregistrée pour {question}")
+    # Words of syllables the knowledge base never uses
+    off_topic = [" ".join(vocabulary(rng, 3, ["qu", "xy", "wo", "kri", "ffa", "jho", "zzu", "pty"]))
+                 for _ in range(queries)]
+
+    probes = [(shortcut, user_id) for shortcut in list(shortcuts) * max(1, queries // len(shortcuts))][:queries]
+    probes += [(question, user_id) for question in saved]
+    probes += [(entries[i].question, user_id) for i in sampled]
+    # Template words: too common for the hybrid threshold, but the full-text index matches them
+    probes += [(rng.choice(INDEX_PROBES), user_id) for _ in sampled]
+    probes += [(question, user_id) for question in off_topic]
+    # The same questions from another user are not saved for them, only cached
+    probes += [(question, other_user_id) for question in off_topic]
+
+    # First call unpickles the classifier and warms the caches
+    chatbot_logic.get_response(entries[0].question, user_id)
+    latencies = {}
+    for query, query_user in probes:
+        began = time.perf_counter()
+        response = chatbot_logic.get_response(query, query_user)
+        latencies.setdefault(response["method"], []).append((time.perf_counter() - began) * 1000)
+    return {
+        "import_data_processing_s": data_processing_s,
+        "import_chatbot_logic_s": chatbot_logic_s,
+        "startup_peak_rss_mb": startup_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "methods": {method: percentiles(values) for method, values in sorted(latencies.items())}
+    }
+
+def worker(args):
+    # Mock first, the client reads its URL at import
+    MockOpenRouter.latency = args.external_latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockOpenRouter)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['OPENROUTER_API_URL'] = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    result = run_build() if args.phase == "build" else run_serve(args.queries, args.seed)
+    print("RESULT " + json.dumps(result))
+
+def run_phase(workdir, phase, args):
+    command = [sys.executable, "-m", "benchmarks.bench_cascade", "--worker", "--phase", phase,
+               "--queries", str(args.queries), "--seed", str(args.seed),
+               "--external-latency-ms", str(args.external_latency_ms)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"{phase} phase failed:\n{completed.stdout[-2000:]}\n{completed.stderr[-4000:]}")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=200, help="probe queries per kind")
+    parser.add_argument('--external-latency-ms', type=float, default=0.0, help="delay of the mock API")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', help="build the knowledge bases under this directory and keep them")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--phase', choices=["build", "serve"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args)
+        return
+
+    results = {"commit": git_commit(), "python": sys.version.split()[0], "queries": args.queries,
+               "external_latency_ms": args.external_latency_ms, "sizes": {}}
+    root = args.keep or tempfile.mkdtemp(prefix="bench-cascade-")
+    try:
+        for size in args.sizes:
+            workdir = os.path.join(root, f"kb-{size}")
+            os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+            with open(os.path.join(workdir, "data", "data.json"), 'w', encoding='utf-8') as f:
+                json.dump(generate_kb(size, args.seed), f, ensure_ascii=False)
+            print(f"{size} entries: building...", flush=True)
+            build = run_phase(workdir, "build", args)
+            serve = run_phase(workdir, "serve", args)
+            results["sizes"][str(size)] = {"build": build, "serve": serve}
+            print(f"  build {build['build_s']:.1f}s, index {build['index_s']:.1f}s, "
+                  f"import data_processing {serve['import_data_processing_s']:.2f}s, "
+                  f"chatbot_logic {serve['import_chatbot_logic_s']:.2f}s, peak RSS {serve['peak_rss_mb']:.0f} MB")
+            for method, stats in serve["methods"].items():
+                print(f"  {method:<18} n={stats['n']:<5} p50 {stats['p50_ms']:8.2f} ms  "
+                      f"p95 {stats['p95_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms")
+    finally:
+        if not args.keep:
+            subprocess.run(["rm", "-rf", root])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
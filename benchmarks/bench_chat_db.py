@@ -0,0 +1,192 @@
+"""Time chat history and session queries before and after the chat schema upgrade.
+
+    python -m benchmarks.bench_chat_db --messages 1000000 --users 1000 --output chat_db.json
+
+A database with the legacy chat tables, string dates and JSON text responses
+without any index, is filled with synthetic users, sessions and messages,
+the messages of a session spread over the whole id range as they are when
+users chat at the same time. The queries behind the sidebar and the history
+pages are timed on it, upgrade_schema migrates it in place, and they are
+timed again on the indexed, typed tables.
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from flask import Flask
+from chatbot.config import HISTORY_PAGE_SIZE, SESSIONS_PAGE_SIZE
+from chatbot.database import db, upgrade_schema
+
+LEGACY_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER NOT NULL, email VARCHAR(120) NOT NULL, name VARCHAR(120),
+    PRIMARY KEY (id), UNIQUE (email)
+);
+CREATE TABLE chat_session (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, date VARCHAR(50) NOT NULL,
+    title VARCHAR(43), message_count INTEGER NOT NULL DEFAULT 0, updated_at VARCHAR(50),
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE chat_message (
+    id INTEGER NOT NULL, session_id INTEGER NOT NULL, user_message TEXT NOT NULL,
+    bot_response TEXT NOT NULL, timestamp VARCHAR(50) NOT NULL,
+    PRIMARY KEY (id), FOREIGN KEY(session_id) REFERENCES chat_session (id)
+);
+CREATE TABLE shared_chat (
+    id INTEGER NOT NULL, token VARCHAR(64) NOT NULL, session_id INTEGER NOT NULL, created_at DATETIME NOT NULL,
+    PRIMARY KEY (id), UNIQUE (token), FOREIGN KEY(session_id) REFERENCES chat_session (id) ON DELETE CASCADE
+);
+"""
+
+# The queries of /api/sessions and of the first and an older history page
+QUERIES = {
+    "sessions_page": ("SELECT id, date, title, message_count, updated_at FROM chat_session "
+                      "WHERE user_id = ? ORDER BY id DESC LIMIT ?"),
+    "history_latest": "SELECT * FROM chat_message WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+    "history_older": "SELECT * FROM chat_message WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+}
+
+def build_legacy_db(path, users, sessions, messages, rng):
+    """Fill a legacy database; return the session id of every message."""
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA)
+    start = datetime.datetime(2025, 1, 1)
+    connection.executemany("INSERT INTO user (id, email, name) VALUES (?, ?, ?)",
+                           ((i, f"user{i}@example.com", f"User {i}") for i in range(1, users + 1)))
+    session_users = rng.integers(1, users + 1, size=sessions)
+    message_sessions = rng.integers(1, sessions + 1, size=messages)
+    counts = np.bincount(message_sessions, minlength=sessions + 1)
+    last_message = np.zeros(sessions + 1, dtype=np.int64)
+    last_message[message_sessions] = np.arange(messages)
+
+    def message_time(i):
+        return (start + datetime.timedelta(seconds=30 * int(i))).isoformat()
+
+    connection.executemany(
+        "INSERT INTO chat_session (id, user_id, date, title, message_count, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        ((i, int(session_users[i - 1]), (start + datetime.timedelta(minutes=i)).isoformat(), f"Question {i}",
+          int(counts[i]), message_time(last_message[i]) if counts[i] else None)
+         for i in range(1, sessions + 1)))
+    response = {"url": None, "similarity": 0.83, "category": "inscription", "is_shortcut": False,
+                "method": "hybrid", "source": "local"}
+
+    def rows():
+        for i, session_id in enumerate(message_sessions):
+            bot_response = json.dumps(dict(response, answer=f"Answer {i} " + "lorem ipsum " * 20))
+            yield i + 1, int(session_id), f"Question {i}", bot_response, message_time(i)
+
+    connection.executemany(
+        "INSERT INTO chat_message (id, session_id, user_message, bot_response, timestamp) VALUES (?, ?, ?, ?, ?)",
+        rows())
+    connection.commit()
+    connection.close()
+    return message_sessions
+
+def decode_legacy(row):
+    return json.loads(row["bot_response"])
+
+def decode_typed(row):
+    response = {key: row[key] for key in ("answer", "method", "similarity", "category", "url")}
+    if row["extra"]:
+        response.update(json.loads(row["extra"]))
+    return response
+
+def time_queries(path, samples, decode):
+    """Return p50/p95 latencies in ms of each query, responses decoded like the app does."""
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    latencies = {name: [] for name in QUERIES}
+    for user_id, session_id, cursor in samples:
+        cases = {
+            "sessions_page": (user_id, SESSIONS_PAGE_SIZE + 1),
+            "history_latest": (session_id, HISTORY_PAGE_SIZE + 1),
+            "history_older": (session_id, cursor, HISTORY_PAGE_SIZE + 1),
+        }
+        for name, params in cases.items():
+            began = time.perf_counter()
+            rows = connection.execute(QUERIES[name], params).fetchall()
+            if name != "sessions_page":
+                [decode(row) for row in rows]
+            latencies[name].append((time.perf_counter() - began) * 1000)
+    connection.close()
+    return {name: {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+            for name, values in latencies.items()}
+
+def query_plans(path, samples):
+    connection = sqlite3.connect(path)
+    user_id, session_id, cursor = samples[0]
+    params = {"sessions_page": (user_id, 1), "history_latest": (session_id, 1), "history_older": (session_id, cursor, 1)}
+    plans = {name: " | ".join(row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", params[name]))
+             for name, sql in QUERIES.items()}
+    connection.close()
+    return plans
+
+def migrate(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath(path)}"
+    db.init_app(app)
+    with app.app_context():
+        began = time.perf_counter()
+        changes = upgrade_schema()
+        elapsed = time.perf_counter() - began
+        db.engine.dispose()
+    return changes, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages-per-session', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help="build the database at this path and keep it, instead of a temporary file")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sessions = max(1, args.messages // args.messages_per_session)
+    tmpdir = None
+    path = args.db
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, "chatbot.db")
+    began = time.perf_counter()
+    message_sessions = build_legacy_db(path, args.users, sessions, args.messages, rng)
+    build_s = time.perf_counter() - began
+
+    # Sessions that have messages, paged from their latest and from half-way through
+    connection = sqlite3.connect(path)
+    picked = []
+    for session_id, user_id in connection.execute(
+            "SELECT id, user_id FROM chat_session WHERE message_count > 0 ORDER BY RANDOM() LIMIT ?",
+            (args.queries,)).fetchall():
+        ids = np.flatnonzero(message_sessions == session_id) + 1
+        picked.append((user_id, session_id, int(ids[len(ids) // 2])))
+    connection.close()
+
+    results = {"messages": args.messages, "sessions": sessions, "users": args.users, "build_s": build_s}
+    results["before"] = time_queries(path, picked, decode_legacy)
+    results["before_plans"] = query_plans(path, picked)
+    changes, results["migrate_s"] = migrate(path)
+    results["migrated"] = changes
+    results["after"] = time_queries(path, picked, decode_typed)
+    results["after_plans"] = query_plans(path, picked)
+    results["db_mb"] = os.path.getsize(path) / 1e6
+
+    print(f"{args.messages} messages, {sessions} sessions, {args.users} users, migrated in {results['migrate_s']:.1f}s")
+    print(f"{'query':<16}{'before p50':>12}{'before p95':>12}{'after p50':>12}{'after p95':>12}")
+    for name in QUERIES:
+        before, after = results["before"][name], results["after"][name]
+        print(f"{name:<16}{before['p50_ms']:>12.3f}{before['p95_ms']:>12.3f}{after['p50_ms']:>12.3f}{after['p95_ms']:>12.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+if __name__ == '__main__':
+    main()
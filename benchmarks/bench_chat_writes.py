@@ -0,0 +1,104 @@
+"""Compare a commit per chat message with write-behind batched commits.
+
+    python -m benchmarks.bench_chat_writes --threads 16 --messages 500
+
+Each thread stands for a chat request handler saving messages to its own
+session of a fresh SQLite database with the app's pragmas. Throughput is
+measured until every message is committed, latency on the request side.
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from flask import Flask
+from chatbot.chat_writer import ChatWriter
+from chatbot.config import SQLITE_PRAGMAS, CHAT_WRITE_BEHIND
+from chatbot.database import db, User, ChatSession, ChatMessage, add_message, set_sqlite_pragmas
+
+RESPONSE = {"answer": "Les inscriptions sont ouvertes du 1er au 30 septembre.", "url": None, "similarity": 0.83,
+            "category": "inscription", "is_shortcut": False, "method": "hybrid", "source": "local"}
+
+def make_app(path, pragmas):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    db.init_app(app)
+    with app.app_context():
+        set_sqlite_pragmas(db.engine, pragmas)
+        db.create_all()
+    return app
+
+def run(app, threads, messages, save):
+    with app.app_context():
+        user = User(email="bench@example.com")
+        db.session.add(user)
+        db.session.flush()
+        sessions = [ChatSession(user_id=user.id, date=datetime.datetime.now()) for _ in range(threads)]
+        db.session.add_all(sessions)
+        db.session.commit()
+        session_ids = [s.id for s in sessions]
+    latencies = [[] for _ in range(threads)]
+
+    def worker(i):
+        with app.app_context():
+            for n in range(messages):
+                began = time.perf_counter()
+                save(session_ids[i], f"Question {n}", RESPONSE, datetime.datetime.now())
+                latencies[i].append((time.perf_counter() - began) * 1000)
+
+    began = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return began, np.concatenate(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=500, help="messages per thread")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {"threads": args.threads, "messages": args.threads * args.messages, "modes": []}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mode in ("commit_per_message", "write_behind"):
+            path = os.path.join(tmpdir, f"{mode}.db")
+            app = make_app(path, SQLITE_PRAGMAS)
+            if mode == "write_behind":
+                writer = ChatWriter(app, CHAT_WRITE_BEHIND["batch_size"], CHAT_WRITE_BEHIND["flush_interval"])
+                writer.start()
+                save = writer.add
+            else:
+                writer = None
+
+                def save(session_id, user_message, response, timestamp):
+                    add_message(session_id, user_message, response, timestamp)
+                    db.session.commit()
+
+            began, latencies = run(app, args.threads, args.messages, save)
+            if writer:
+                writer.close()
+            elapsed = time.perf_counter() - began
+            with app.app_context():
+                stored = ChatMessage.query.count()
+                db.engine.dispose()
+            results["modes"].append({"mode": mode, "stored": stored, "elapsed_s": elapsed,
+                                     "messages_per_s": stored / elapsed,
+                                     "p50_ms": float(np.percentile(latencies, 50)),
+                                     "p95_ms": float(np.percentile(latencies, 95))})
+
+    print(f"{'mode':<20}{'stored':>8}{'msg/s':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for mode in results["modes"]:
+        print(f"{mode['mode']:<20}{mode['stored']:>8}{mode['messages_per_s']:>10.0f}"
+              f"{mode['p50_ms']:>9.3f}{mode['p95_ms']:>9.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Compare ranking queries in-process with ranking them through the retrieval service.
+
+    python -m benchmarks.bench_retrieval_service --threads 1 8 32 --workers 4 --duration 10
+
+Run from the repo root on its published artifacts. Each thread stands for a
+request handler ranking one question at a time, first with rank() in this
+process, where all threads share one GIL, then through a RetrievalClient
+against a service started with --workers processes. Reports queries per
+second, latency percentiles and, for the service, how many queries the
+client merged per batch on average.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from chatbot.artifacts import load_artifacts
+from chatbot.config import ARTIFACTS_DIR, DATA_PATH, RETRIEVAL_SERVICE
+from chatbot.retrieval_service import RetrievalClient, rank
+from chatbot.snapshot import KnowledgeSnapshot
+
+def load_questions():
+    with open(DATA_PATH, encoding='utf-8') as f:
+        entries = json.load(f)
+    return [q for entry in entries for q in [entry['question']] + (entry.get('question_variations') or [])]
+
+def run(threads, duration, questions, rank_one):
+    latencies = [[] for _ in range(threads)]
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        n = i
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            rank_one(questions[n % len(questions)])
+            latencies[i].append((time.perf_counter() - began) * 1000)
+            n += threads
+
+    began = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    values = np.concatenate(latencies)
+    return {
+        "queries_per_s": len(values) / elapsed,
+        "p50_ms": float(np.percentile(values, 50)),
+        "p99_ms": float(np.percentile(values, 99))
+    }
+
+def start_service(address, workers):
+    env = dict(os.environ, RETRIEVAL_SERVICE_ADDRESS=address, RETRIEVAL_SERVICE_WORKERS=str(workers))
+    process = subprocess.Popen([sys.executable, "-m", "chatbot.retrieval_service"], env=env)
+    for _ in range(600):
+        if os.path.exists(address):
+            return process
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The retrieval service did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="retrieval service processes")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per run")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    snapshot = KnowledgeSnapshot(load_artifacts(ARTIFACTS_DIR))
+    questions = load_questions()
+    # Unpickles the classifier and warms the caches
+    rank(snapshot, questions[:10])
+    address = os.path.join(tempfile.mkdtemp(prefix="bench-retrieval-"), "retrieval.sock")
+    service = start_service(address, args.workers)
+    results = {"workers": args.workers, "cpus": os.cpu_count(), "local": {}, "service": {}}
+    try:
+        for threads in args.threads:
+            local = run(threads, args.duration, questions, lambda q: rank(snapshot, [q]))
+            client = RetrievalClient(address, RETRIEVAL_SERVICE["connections"], RETRIEVAL_SERVICE["max_batch"],
+                                     RETRIEVAL_SERVICE["timeout"])
+            client.start()
+            remote = run(threads, args.duration, questions, lambda q: client.rank(snapshot.version, [q]))
+            remote["queries_per_batch"] = client.batched_queries / max(client.batches, 1)
+            results["local"][threads] = local
+            results["service"][threads] = remote
+            print(f"{threads:>3} threads  local   {local['queries_per_s']:8.1f} q/s  p50 {local['p50_ms']:7.2f} ms  "
+                  f"p99 {local['p99_ms']:7.2f} ms")
+            print(f"{'':>11}service {remote['queries_per_s']:8.1f} q/s  p50 {remote['p50_ms']:7.2f} ms  "
+                  f"p99 {remote['p99_ms']:7.2f} ms  {remote['queries_per_batch']:.1f} queries/batch")
+    finally:
+        service.terminate()
+        service.wait()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
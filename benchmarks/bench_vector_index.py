@@ -0,0 +1,79 @@
+"""Compare the exact and IVF embedding index backends.
+
+    python -m benchmarks.bench_vector_index --rows 100000 --dim 100 --k 10
+
+Vectors are drawn around random cluster centres, like sentence embeddings
+of a scraped site, and queries are noisy copies of stored rows. Recall@k is
+measured against the exact backend.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from chatbot.vector_index import ExactIndex, IVFIndex, normalize_rows
+
+def synthetic_vectors(rows, dim, clusters, rng):
+    centres = rng.normal(size=(clusters, dim))
+    labels = rng.integers(clusters, size=rows)
+    return normalize_rows(centres[labels] + 0.6 * rng.normal(size=(rows, dim)))
+
+def time_search(index, queries, k, batch_size):
+    """Return per-query latencies in ms, searching batch_size queries at a time, and the results."""
+    latencies = []
+    indices = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        began = time.perf_counter()
+        found, _ = index.search(batch, k=k)
+        latencies.append((time.perf_counter() - began) * 1000 / len(batch))
+        indices.append(found)
+    return np.array(latencies), np.vstack(indices)
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=100)
+    parser.add_argument('--clusters', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_vectors(args.rows, args.dim, args.clusters, rng)
+    queries = vectors[rng.choice(args.rows, size=args.queries)] + 0.3 * rng.normal(size=(args.queries, args.dim))
+
+    results = {"rows": args.rows, "dim": args.dim, "k": args.k, "batch_size": args.batch_size, "backends": []}
+    exact = ExactIndex(vectors, normalized=True)
+    latencies, truth = time_search(exact, queries, args.k, args.batch_size)
+    results["backends"].append({"backend": "exact", "build_s": 0.0, "recall": 1.0,
+                                "p50_ms": float(np.percentile(latencies, 50)),
+                                "p95_ms": float(np.percentile(latencies, 95))})
+
+    began = time.perf_counter()
+    ivf = IVFIndex(vectors, normalized=True, seed=args.seed)
+    build_s = time.perf_counter() - began
+    for n_probe in args.n_probe:
+        ivf.n_probe = min(n_probe, ivf.n_lists)
+        latencies, found = time_search(ivf, queries, args.k, args.batch_size)
+        results["backends"].append({"backend": f"ivf(n_lists={ivf.n_lists}, n_probe={ivf.n_probe})",
+                                    "build_s": build_s, "recall": recall(found, truth),
+                                    "p50_ms": float(np.percentile(latencies, 50)),
+                                    "p95_ms": float(np.percentile(latencies, 95))})
+
+    print(f"{args.rows} rows x {args.dim} dims, recall@{args.k}, batch size {args.batch_size}")
+    for row in results["backends"]:
+        print(f"{row['backend']:<36} recall={row['recall']:.3f}  p50={row['p50_ms']:.3f} ms  "
+              f"p95={row['p95_ms']:.3f} ms  build={row['build_s']:.1f} s")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Cross-user cache of answers produced by the external LLM.
+
+A query hits the cache when its normalized text was answered before, or
+when its embedding is close enough to that of a cached query. Entries
+expire after a TTL, the least recently used ones are evicted beyond
+max_entries, and the whole cache is dropped when the knowledge base
+changes, since a question it now answers locally should not keep getting
+the external answer.
+
+The cache lives in memory and is persisted in SQLite, which also lets
+processes sharing the database file see each other's exact matches.
+"""
+import re
+import string
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from chatbot.sqlite_store import SQLiteStore
+
+_PUNCTUATION = re.compile('[%s’«»¿¡]' % re.escape(string.punctuation))
+_SPACES = re.compile(r'\s+')
+
+def normalize_query(query):
+    """Lowercase, strip punctuation and collapse whitespace."""
+    query = unicodedata.normalize('NFKC', query).lower()
+    return _SPACES.sub(' ', _PUNCTUATION.sub(' ', query)).strip()
+
+class CachedAnswer:
+    __slots__ = ('question', 'answer', 'vector', 'created_at', 'hits')
+
+    def __init__(self, question, answer, vector, created_at, hits=0):
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.created_at = created_at
+        self.hits = hits
+
+class AnswerCache(SQLiteStore):
+    def __init__(self, path, kb_version, max_entries=10000, ttl_seconds=7 * 24 * 3600, min_similarity=0.92):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.min_similarity = min_similarity
+        self._entries = OrderedDict()
+        self._keys = []
+        self._matrix = None
+        super().__init__(path, '''
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                normalized TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                vector BLOB,
+                created_at REAL NOT NULL,
+                last_hit REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS ix_answer_cache_last_hit ON answer_cache (last_hit);
+            CREATE TABLE IF NOT EXISTS answer_cache_meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        self._load(kb_version)
+
+    def _load(self, kb_version):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM answer_cache_meta WHERE key = 'kb_version'").fetchone()
+            if row is None or row[0] != kb_version:
+                self._invalidate_locked(kb_version)
+                return
+            self._conn.execute('DELETE FROM answer_cache WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+            rows = self._conn.execute(
+                'SELECT normalized, question, answer, vector, created_at, hits FROM answer_cache '
+                'ORDER BY last_hit DESC LIMIT ?', (self.max_entries,)).fetchall()
+        for normalized, question, answer, vector, created_at, hits in reversed(rows):
+            self._entries[normalized] = CachedAnswer(question, answer, self._decode(vector), created_at, hits)
+        self._matrix = None
+
+    @staticmethod
+    def _decode(blob):
+        return np.frombuffer(blob, dtype=np.float32) if blob else None
+
+    @staticmethod
+    def _unit(vector):
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _expired(self, entry, now):
+        return now - entry.created_at > self.ttl_seconds
+
+    def get(self, query, vector=None):
+        """Return (answer, similarity) for query, or None on a miss."""
+        normalized = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(normalized)
+            if entry is None:
+                entry = self._load_one(normalized)
+            if entry is not None and not self._expired(entry, now):
+                self._hit(normalized, entry, now)
+                return entry.answer, 1.0
+            if entry is not None:
+                self._remove(normalized)
+
+            unit = self._unit(vector)
+            if unit is None or not self._entries:
+                return None
+            if self._matrix is None:
+                self._rebuild_matrix()
+            if not self._keys:
+                return None
+            similarities = self._matrix @ unit
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.min_similarity:
+                return None
+            key = self._keys[best]
+            entry = self._entries[key]
+            if self._expired(entry, now):
+                self._remove(key)
+                return None
+            self._hit(key, entry, now)
+            return entry.answer, float(similarities[best])
+
+    def put(self, query, answer, vector=None):
+        normalized = normalize_query(query)
+        if not normalized:
+            return
+        unit = self._unit(vector)
+        now = time.time()
+        with self._lock:
+            self._entries[normalized] = CachedAnswer(query, answer, unit, now)
+            self._entries.move_to_end(normalized)
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO answer_cache (normalized, question, answer, vector, created_at, last_hit, hits) '
+                    'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                    (normalized, query, answer, unit.tobytes() if unit is not None else None, now, now))
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._matrix = None
+
+    def invalidate(self, kb_version):
+        """Drop every cached answer, e.g. because the knowledge base changed.
+
+        If another process sharing the database already invalidated it for
+        kb_version, only the answers held in memory here are dropped, not
+        those cached since.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM answer_cache_meta WHERE key = 'kb_version'").fetchone()
+            if row is not None and row[0] == kb_version:
+                self._entries.clear()
+                self._matrix = None
+            else:
+                self._invalidate_locked(kb_version)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": sum(entry.hits for entry in self._entries.values())
+            }
+
+    def _invalidate_locked(self, kb_version):
+        self._conn.execute('DELETE FROM answer_cache')
+        self._conn.execute("INSERT OR REPLACE INTO answer_cache_meta (key, value) VALUES ('kb_version', ?)",
+                           (kb_version,))
+        self._entries.clear()
+        self._matrix = None
+
+    def _load_one(self, normalized):
+        """Pick up an exact match written by another process."""
+        row = self._conn.execute(
+            'SELECT question, answer, vector, created_at, hits FROM answer_cache WHERE normalized = ?',
+            (normalized,)).fetchone()
+        if row is None:
+            return None
+        question, answer, vector, created_at, hits = row
+        entry = CachedAnswer(question, answer, self._decode(vector), created_at, hits)
+        self._entries[normalized] = entry
+        self._matrix = None
+        return entry
+
+    def _hit(self, key, entry, now):
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        with self._conn:
+            self._conn.execute('UPDATE answer_cache SET hits = hits + 1, last_hit = ? WHERE normalized = ?',
+                               (now, key))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        with self._conn:
+            self._conn.execute('DELETE FROM answer_cache WHERE normalized = ?', (key,))
+        self._matrix = None
+
+    def _rebuild_matrix(self):
+        self._keys = [key for key, entry in self._entries.items() if entry.vector is not None]
+        if self._keys:
+            self._matrix = np.vstack([self._entries[key].vector for key in self._keys])
+        else:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
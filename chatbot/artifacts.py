@@ -0,0 +1,224 @@
+"""Offline build and read-only loading of the knowledge-base artifacts.
+
+Build a new version with:
+
+    python -m chatbot.artifacts --data data/data.json --out models/kb
+
+Answers rated while serving are first folded into the data file from
+their log, see chatbot.update_log. Each build is written to its own
+directory under the output root and the ``CURRENT`` file is switched to it
+atomically, so serving processes never see a half-written bundle.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from gensim.models import FastText
+from chatbot.config import DATA_PATH, ARTIFACTS_DIR, KB_UPDATES_DB_PATH, MODEL_PATHS
+from chatbot.preprocessing import default_preprocessor, tokens_vector_fasttext
+from chatbot.vector_index import normalize_rows
+from chatbot.knowledge_base import Entry, KnowledgeBase
+from chatbot.update_log import UpdateLog
+
+# Bump whenever the layout or the preprocessing of the rows changes
+ARTIFACT_FORMAT = 3
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+class StaleArtifactsError(ValueError):
+    """The published bundle was written by an incompatible build."""
+
+def data_hash(path=DATA_PATH):
+    """Return the sha256 hex digest of the knowledge-base file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_entries(path=DATA_PATH):
+    """Read the raw knowledge-base entries from JSON."""
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def expand_entries(data):
+    """Return the question rows and the entry index of every row."""
+    questions = []
+    row_to_entry = []
+    for entry_id, entry in enumerate(data):
+        rows = [entry['question']] + entry.get('question_variations', [])
+        questions.extend(rows)
+        row_to_entry.extend([entry_id] * len(rows))
+    return questions, np.asarray(row_to_entry, dtype=np.int32)
+
+def _write_json(path, payload):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _save_fasttext(tokenized_questions, bundle_dir):
+    """Store the FastText model in the bundle, reusing a trained model if present."""
+    target = os.path.join(bundle_dir, 'fasttext.model')
+    source = MODEL_PATHS['fasttext']
+    if os.path.exists(source):
+        # Gensim stores large arrays next to the model file, link them all
+        for path in glob.glob(source + '*'):
+            _link_or_copy(path, os.path.join(bundle_dir, 'fasttext.model' + path[len(source):]))
+        return FastText.load(target)
+    model = FastText(tokenized_questions, vector_size=100, window=5, min_count=1, workers=4)
+    model.save(target, sep_limit=0)
+    return model
+
+def build_artifacts(data_path=DATA_PATH, out_root=ARTIFACTS_DIR, updates_path=None):
+    """Fit every retrieval artifact from data_path and publish a new version.
+
+    The ratings logged in the UpdateLog at updates_path, if given, are first
+    folded into data_path, and the manifest records the last row folded.
+    """
+    updates_through = UpdateLog(updates_path).fold_into(data_path) if updates_path else 0
+    data = read_entries(data_path)
+    digest = data_hash(data_path)
+    questions, row_to_entry = expand_entries(data)
+    # Bypass the query cache, build-time rows would only evict live queries
+    processed_questions = [default_preprocessor.process(q) for q in questions]
+
+    vectorizer = TfidfVectorizer(ngram_range=(1, 2), max_df=0.9, min_df=2)
+    tfidf_matrix = vectorizer.fit_transform(processed_questions).tocsr()
+    tfidf_matrix.sort_indices()
+    # Only kept for introspection and can be large, see TfidfVectorizer docs
+    vectorizer.stop_words_ = None
+
+    os.makedirs(out_root, exist_ok=True)
+    bundle_dir = tempfile.mkdtemp(prefix='.build-', dir=out_root)
+    try:
+        tokenized_questions = [q.split() for q in processed_questions]
+        fasttext_model = _save_fasttext(tokenized_questions, bundle_dir)
+        # Stored unit-normalized so the serving index can use the mapping as is
+        vectors = normalize_rows(np.array([tokens_vector_fasttext(tokens, fasttext_model) for tokens in tokenized_questions],
+                                          dtype=np.float32).reshape(len(questions), fasttext_model.vector_size))
+
+        with open(os.path.join(bundle_dir, 'vectorizer.pkl'), 'wb') as f:
+            pickle.dump(vectorizer, f)
+        # np.load cannot memory-map members of an .npz archive, so the CSR
+        # components are stored as plain .npy files
+        np.save(os.path.join(bundle_dir, 'tfidf_data.npy'), tfidf_matrix.data.astype(np.float32))
+        # scipy upcasts mismatched index arrays, which would copy the mapping
+        index_dtype = np.int32 if tfidf_matrix.nnz < np.iinfo(np.int32).max else np.int64
+        np.save(os.path.join(bundle_dir, 'tfidf_indices.npy'), tfidf_matrix.indices.astype(index_dtype))
+        np.save(os.path.join(bundle_dir, 'tfidf_indptr.npy'), tfidf_matrix.indptr.astype(index_dtype))
+        np.save(os.path.join(bundle_dir, 'fasttext_vectors.npy'), vectors)
+        np.save(os.path.join(bundle_dir, 'row_to_entry.npy'), row_to_entry)
+        _write_json(os.path.join(bundle_dir, 'entries.json'), [Entry.from_dict(e).to_dict() for e in data])
+        _write_json(os.path.join(bundle_dir, 'questions.json'),
+                    {"questions": questions, "processed": processed_questions})
+
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{digest[:12]}"
+        _write_json(os.path.join(bundle_dir, MANIFEST_FILE), {
+            "format": ARTIFACT_FORMAT,
+            "version": version,
+            "data_hash": digest,
+            "updates_through": updates_through,
+            "created_at": time.time(),
+            "n_entries": len(data),
+            "n_rows": len(questions),
+            "tfidf_shape": list(tfidf_matrix.shape),
+            "vector_size": fasttext_model.vector_size
+        })
+        final_dir = os.path.join(out_root, version)
+        os.replace(bundle_dir, final_dir)
+    except Exception:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        raise
+
+    publish_current(out_root, version)
+    return final_dir
+
+def publish_current(out_root, version):
+    """Atomically point the CURRENT file of out_root at version."""
+    pointer = os.path.join(out_root, CURRENT_FILE)
+    tmp_pointer = f"{pointer}.{os.getpid()}.tmp"
+    with open(tmp_pointer, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_pointer, pointer)
+
+def current_bundle_dir(out_root=ARTIFACTS_DIR):
+    """Return the directory of the published bundle, or None."""
+    try:
+        with open(os.path.join(out_root, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    bundle_dir = os.path.join(out_root, version)
+    return bundle_dir if os.path.isdir(bundle_dir) else None
+
+class ArtifactBundle:
+    """Read-only view over a built bundle; arrays are memory-mapped."""
+
+    def __init__(self, bundle_dir):
+        self.path = bundle_dir
+        with open(os.path.join(bundle_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != ARTIFACT_FORMAT:
+            raise StaleArtifactsError(f"Unsupported artifact format in {bundle_dir}: {self.manifest.get('format')}")
+        self.version = self.manifest['version']
+        self.data_hash = self.manifest['data_hash']
+        # Rows of the update log already part of the data, later ones are replayed while serving
+        self.updates_through = self.manifest.get('updates_through', 0)
+
+        with open(os.path.join(bundle_dir, 'vectorizer.pkl'), 'rb') as f:
+            self.vectorizer = pickle.load(f)
+        self.tfidf_matrix = sparse.csr_matrix(
+            (self._array('tfidf_data'), self._array('tfidf_indices'), self._array('tfidf_indptr')),
+            shape=tuple(self.manifest['tfidf_shape']), copy=False)
+        self.fasttext_question_vectors = self._array('fasttext_vectors')
+        self.row_to_entry = self._array('row_to_entry')
+        self.fasttext_model = FastText.load(os.path.join(bundle_dir, 'fasttext.model'), mmap='r')
+
+        with open(os.path.join(bundle_dir, 'entries.json'), 'r', encoding='utf-8') as f:
+            entries = [Entry.from_dict(entry) for entry in json.load(f)]
+        self.knowledge_base = KnowledgeBase(entries, self.row_to_entry)
+
+    def _array(self, name):
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+    def question_rows(self):
+        """Raw and preprocessed text of every question row, not needed for serving."""
+        with open(os.path.join(self.path, 'questions.json'), 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+        return rows['questions'], rows['processed']
+
+def load_artifacts(out_root=ARTIFACTS_DIR):
+    """Load the published bundle, or return None if none was built yet."""
+    bundle_dir = current_bundle_dir(out_root)
+    return ArtifactBundle(bundle_dir) if bundle_dir else None
+
+def load_published(out_root=ARTIFACTS_DIR, data_path=DATA_PATH):
+    """Load the published bundle to serve it, raising StaleArtifactsError unless it was built from data_path as is."""
+    bundle = load_artifacts(out_root)
+    if bundle is None:
+        raise StaleArtifactsError(f"No knowledge-base artifacts in {out_root}")
+    if bundle.data_hash != data_hash(data_path):
+        raise StaleArtifactsError(f"Artifacts {bundle.version} were built from another version of {data_path}")
+    return bundle
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the knowledge-base artifact bundle.")
+    parser.add_argument('--data', default=DATA_PATH, help="knowledge-base JSON file")
+    parser.add_argument('--out', default=ARTIFACTS_DIR, help="artifact root directory")
+    parser.add_argument('--updates', default=KB_UPDATES_DB_PATH,
+                        help="log of rated answers to fold into --data first, empty to leave the data as is")
+    args = parser.parse_args()
+    print(f"Artifacts written to {build_artifacts(args.data, args.out, args.updates)}")
@@ -0,0 +1,177 @@
+"""Write-behind persistence of chat messages.
+
+In write-behind mode requests queue their messages here instead of
+committing them one by one. A background thread commits whatever is queued
+in a single transaction every flush_interval seconds, or as soon as
+batch_size messages wait, so concurrent chats share one SQLite commit
+instead of queueing behind each other's.
+
+Queued messages stay readable through pending() until they are committed,
+so the history of a session shows them at once. close() flushes the queue
+and is registered with atexit; a process killed outright loses at most the
+messages of one flush interval. The queue is per process: a session must be
+read back by the process that wrote to it to see its unflushed messages.
+
+A batch that fails max_attempts flushes in a row is written one message at
+a time, and the messages that still fail are appended to the dead-letter
+JSONL file, with the error, and dropped, so one bad message cannot hold
+the queue forever.
+"""
+import atexit
+import json
+import os
+import threading
+from chatbot.database import db, ChatSession, add_messages
+
+class ChatWriter:
+    def __init__(self, app, batch_size=500, flush_interval=0.05, max_attempts=5, dead_letter_path=None):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        # Failed flushes of the batch at the head of the queue
+        self._failures = 0
+        # Oldest first. Messages get their id when inserted and leave once committed.
+        self._queue = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def add(self, session_id, user_message, bot_response, timestamp):
+        """Queue a message, with the arguments of add_message."""
+        message = {
+            "id": None,
+            "session_id": session_id,
+            "user_message": user_message,
+            "bot_response": bot_response,
+            "timestamp": timestamp
+        }
+        with self._lock:
+            self._queue.append(message)
+            full = len(self._queue) >= self.batch_size
+        if self._closed:
+            # Too late for the background thread, write it now
+            self.flush()
+        elif full:
+            self._wakeup.set()
+        return message
+
+    def pending(self, session_id):
+        """Messages of the session not committed yet, oldest first.
+
+        Read them before querying the committed ones: a message committed
+        meanwhile then has an id that the query returned.
+        """
+        with self._lock:
+            return [message for message in self._queue if message["session_id"] == session_id]
+
+    def flush(self):
+        """Commit the queued messages; return how many were written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._queue[:self.batch_size]
+                if not batch:
+                    return written
+                try:
+                    written += self._write(batch)
+                except Exception as e:
+                    self._failures += 1
+                    if self._failures < self.max_attempts:
+                        print(f"Error writing chat messages, retrying later: {e}")
+                        return written
+                    print(f"Error writing chat messages {self._failures} times in a row, "
+                          f"writing them one at a time: {e}")
+                    written += self._write_each(batch)
+                self._failures = 0
+                with self._lock:
+                    del self._queue[:len(batch)]
+
+    def _write(self, batch):
+        """Insert and commit a batch in one transaction, or raise and leave it unwritten."""
+        with self.app.app_context():
+            try:
+                # Messages of sessions deleted while they were queued are dropped
+                existing = set(db.session.execute(
+                    db.select(ChatSession.id).where(ChatSession.id.in_({m["session_id"] for m in batch}))
+                ).scalars())
+                kept = [message for message in batch if message["session_id"] in existing]
+                if kept:
+                    for message, message_id in zip(kept, add_messages(kept)):
+                        message["id"] = message_id
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                for message in batch:
+                    message["id"] = None
+                raise
+        return len(kept)
+
+    def _write_each(self, batch):
+        """Write the messages of a failing batch one at a time, dead-lettering those that fail."""
+        written = 0
+        for message in batch:
+            try:
+                written += self._write([message])
+            except Exception as e:
+                self._dead_letter(message, e)
+        return written
+
+    def _dead_letter(self, message, error):
+        print(f"Dropping chat message of session {message['session_id']}: {error}")
+        if not self.dead_letter_path:
+            return
+        record = {
+            "session_id": message["session_id"],
+            "user_message": message["user_message"],
+            "bot_response": message["bot_response"],
+            "timestamp": message["timestamp"].isoformat(),
+            "error": str(error)
+        }
+        try:
+            directory = os.path.dirname(self.dead_letter_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"Error writing {self.dead_letter_path}: {e}")
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        """Flush on a background thread, and on exit."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="chat-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self._thread
+
+    def close(self, timeout=10):
+        """Stop the background thread and commit what is still queued."""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+def unflushed(pending, committed_ids):
+    """The messages of pending that a query returning committed_ids did not see."""
+    return [message for message in pending if message["id"] is None or message["id"] not in committed_ids]
+
+def message_dict(message):
+    """A queued message in the format of ChatMessage.to_dict."""
+    return {
+        'id': message["id"],
+        'user_message': message["user_message"],
+        'bot_response': message["bot_response"],
+        'timestamp': message["timestamp"].isoformat()
+    }
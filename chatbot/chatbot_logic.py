@@ -1,51 +1,118 @@
-import os
+import time
 import requests
-import json
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 from whoosh.qparser import QueryParser
-from chatbot.data_processing import ix, responses, urls, preprocess_text, vectorizer, tfidf_matrix, file_paths
-from chatbot.models import nb_classifier, knn_classifier
-from chatbot.config import shortcuts, shortcut_urls
-from chatbot.embeddings_utils import get_best_match_with_fasttext
-from dotenv import load_dotenv
-
-# Load environment variables for API key
-load_dotenv()
-API_KEY = os.getenv('OPENROUTER_API_KEY')
-API_URL = 'https://openrouter.ai/api/v1/chat/completions'
-
-def call_openrouter_api(query):
-    """Call OpenRouter API to generate a response."""
+from chatbot.data_processing import ix, preprocess_text, bundle, load_data
+from chatbot.artifacts import build_artifacts, load_artifacts
+from chatbot.train import train_models
+from chatbot.config import shortcuts, shortcut_urls, BATCH_CHUNK_SIZE, RETRIEVAL, ANSWER_CACHE
+from chatbot.config import NEW_QUESTIONS_PATH, NEW_QUESTIONS_DB_PATH, KB_UPDATES_DB_PATH, LIVE_UPDATES
+from chatbot.config import SNAPSHOT_WATCH_INTERVAL
+from chatbot.config import ARTIFACTS_DIR, DATA_PATH, DEBUG_TIMINGS, RETRIEVAL_SERVICE, LLM_CLIENT
+from chatbot.snapshot import SnapshotManager, KnowledgeSnapshot
+from chatbot.answer_cache import AnswerCache
+from chatbot.question_store import QuestionStore
+from chatbot.live_updates import LiveIndex
+from chatbot.update_log import UpdateLog
+from chatbot.retrieval_service import RetrievalClient, RetrievalUnavailable, rank
+from chatbot.metrics import timed, count_results, RESPONSES, STAGE_SECONDS
+from chatbot import llm_client
+
+API_ERROR_ANSWER = "Sorry, I could not connect to the OpenRouter API."
+
+# Ratings logged by any process, replayed on top of every snapshot
+live_index = LiveIndex(UpdateLog(KB_UPDATES_DB_PATH), ix, **LIVE_UPDATES)
+
+def _prepare_snapshot(snapshot):
+    """Bring the full-text index and a new snapshot up to date before it is swapped in."""
+    load_data(snapshot.bundle)
+    snapshot.updates_applied = live_index.replay(snapshot.retriever, snapshot.bundle.updates_through)
+
+def _kb_version():
+    return f"{snapshots.current.data_hash}+{live_index.version}"
+
+def _publish_snapshot(snapshot):
+    """Point the live updates and the answer cache at a newly swapped-in snapshot."""
+    live_index.attach(snapshot.retriever, snapshot.updates_applied)
+    answer_cache.invalidate(_kb_version())
+
+# Requests read the current snapshot once and keep it until they are done
+_snapshot = KnowledgeSnapshot(bundle)
+_prepare_snapshot(_snapshot)
+snapshots = SnapshotManager(_snapshot, prepare=_prepare_snapshot, on_swap=_publish_snapshot)
+live_index.attach(_snapshot.retriever, _snapshot.updates_applied)
+
+# External answers are shared by all users until the knowledge base changes
+answer_cache = AnswerCache(
+    ANSWER_CACHE["path"],
+    kb_version=_kb_version(),
+    max_entries=ANSWER_CACHE["max_entries"],
+    ttl_seconds=ANSWER_CACHE["ttl_seconds"],
+    min_similarity=ANSWER_CACHE["min_similarity"]
+)
+question_store = QuestionStore(NEW_QUESTIONS_DB_PATH)
+question_store.migrate_jsonl(NEW_QUESTIONS_PATH)
+
+# Hybrid retrieval is ranked by the retrieval service when one is configured
+retrieval_client = None
+if RETRIEVAL_SERVICE["address"]:
+    retrieval_client = RetrievalClient(RETRIEVAL_SERVICE["address"], RETRIEVAL_SERVICE["connections"],
+                                       RETRIEVAL_SERVICE["max_batch"], RETRIEVAL_SERVICE["timeout"])
+
+def start_worker():
+    """Set up what each serving process needs of its own, once it runs.
+
+    Everything above is loaded at import, so a pre-forking server importing
+    this module before forking shares it between workers. Threads do not
+    survive a fork and SQLite connections and sockets must not be used on
+    both sides of one, so they are opened here, in the worker. Whoosh
+    searchers are opened per search and need nothing.
+    """
+    question_store.reopen()
+    answer_cache.reopen()
+    live_index.log.reopen()
+    llm_client.reset_session()
+    if retrieval_client:
+        retrieval_client.start()
+    live_index.start_compaction()
+    # A cached external answer may now be shadowed by the knowledge base
+    live_index.start_polling(on_change=lambda: answer_cache.invalidate(_kb_version()))
+    if SNAPSHOT_WATCH_INTERVAL:
+        snapshots.watch(interval=SNAPSHOT_WATCH_INTERVAL)
+
+def reload_knowledge(rebuild=False):
+    """Swap in the published artifacts, rebuilding and retraining from data.json first if asked.
+
+    Returns True if a new snapshot was swapped in.
+    """
+    if rebuild:
+        build_artifacts(DATA_PATH, ARTIFACTS_DIR, KB_UPDATES_DB_PATH)
+        train_models(load_artifacts(ARTIFACTS_DIR))
+    return snapshots.reload(ARTIFACTS_DIR)
+
+def call_openrouter_api(query, deadline=None):
+    """Call OpenRouter API to generate a response, None if it could not answer in time."""
     try:
-        headers = {
-            'Authorization': f'Bearer {API_KEY}',
-            'Content-Type': 'application/json',
-            'HTTP-Referer': 'http://localhost:8080',
-            'X-Title': 'ISBOT'
-        }
-        payload = {
-            'model': 'meta-llama/llama-3.1-8b-instruct:free',
-            'messages': [
-                {'role': 'system', 'content': 'You are a helpful assistant.'},
-                {'role': 'user', 'content': query}
-            ]
-        }
-        response = requests.post(API_URL, json=payload, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        answer = data['choices'][0]['message']['content'].strip()
-        return answer
+        return llm_client.complete(query, deadline)
+    except llm_client.ExternalUnavailable:
+        # Circuit open or out of time, not worth a line per request
+        return None
     except requests.RequestException as e:
         print(f"OpenRouter API request failed: {e}")
-        return "Sorry, I could not connect to the OpenRouter API."
+        return None
 
 def search_in_index(query):
     """Search the Whoosh index for a matching question."""
+    return search_in_index_batch([query])[0]
+
+def search_in_index_batch(queries):
+    """Search the Whoosh index for several queries with a single searcher."""
+    matches = []
     with ix.searcher() as searcher:
-        query_obj = QueryParser("question", ix.schema).parse(query)
-        results = searcher.search(query_obj, limit=1)
-        return {"answer": results[0]['answer'], "url": results[0]['url']} if results else None
+        parser = QueryParser("question", ix.schema)
+        for query in queries:
+            results = searcher.search(parser.parse(query), limit=1)
+            matches.append({"answer": results[0]['answer'], "url": results[0]['url']} if results else None)
+    return matches
 
 def get_shortcut_url(shortcut):
     """Get the URL for a shortcut command."""
@@ -53,25 +120,18 @@ def get_shortcut_url(shortcut):
     return f"https://isetsf.rnu.tn{path}" if path else None
 
 def check_new_questions(user_input, user_id):
-    """Check if the question exists in new_questions.json for the user."""
+    """Return the saved response of the user to this question, if any."""
     try:
-        if not os.path.exists('data/new_questions.json'):
-            return None
-        
-        with open('data/new_questions.json', 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    entry = json.loads(line)
-                    if entry['question'].lower() == user_input.lower() and entry['user_id'] == user_id:
-                        return entry['response']
-        return None
+        return question_store.find(user_id, user_input)
     except Exception as e:
-        print(f"Error checking new_questions.json: {e}")
+        print(f"Error checking saved questions: {e}")
         return None
 
-def get_response(user_input, user_id):
-    """Process user input and return the best matching response."""
-    saved_response = check_new_questions(user_input, user_id)
+def _local_response(user_input, user_id, timings=None):
+    """Answer saved questions, shortcuts and commands without any retrieval."""
+    with timed("saved_questions", timings):
+        saved_response = check_new_questions(user_input, user_id)
+    count_results("saved_questions", bool(saved_response), not saved_response)
     if saved_response:
         return {
             "answer": saved_response,
@@ -83,7 +143,10 @@ def get_response(user_input, user_id):
             "source": "local"
         }
 
-    if user_input.lower() in ['hello', 'hi', 'hey'] or user_input in shortcuts:
+    known = user_input.lower() in ['hello', 'hi', 'hey'] or user_input in shortcuts
+    handled = known or user_input.startswith('/')
+    count_results("shortcut", handled, not handled)
+    if known:
         return {
             "answer": shortcuts.get(user_input, "Hello! How can I assist you today?"),
             "url": get_shortcut_url(user_input),
@@ -103,76 +166,160 @@ def get_response(user_input, user_id):
             "method": "shortcut",
             "source": "local"
         }
+    return None
 
-    processed_input = preprocess_text(user_input)
-    input_tfidf = vectorizer.transform([processed_input])
-    input_dense = input_tfidf.toarray()
+def _entry_response(snapshot, entry_id, similarity, category, method):
+    """Build the response for a matched knowledge-base entry."""
+    entry = snapshot.knowledge_base[entry_id]
+    return {
+        "answer": entry.answer,
+        "url": f"https://isetsf.rnu.tn{entry.url}" if entry.url else None,
+        "file_path": entry.file_path if entry.file_path else None,
+        "similarity": float(similarity),
+        "category": category,
+        "is_shortcut": False,
+        "method": method,
+        "source": "local"
+    }
 
-    # TF-IDF approach
-    similarities = cosine_similarity(input_tfidf, tfidf_matrix)
-    best_match_idx = similarities.argmax()
-    max_similarity = similarities[0, best_match_idx]
-    category_tfidf = nb_classifier.predict(input_tfidf)[0]
+def get_response(user_input, user_id):
+    """Process user input and return the best matching response."""
+    return get_responses([user_input], user_id)[0]
 
-    if max_similarity > 0.65:
-        return {
-            "answer": responses[best_match_idx],
-            "url": f"https://isetsf.rnu.tn{urls[best_match_idx]}" if urls[best_match_idx] else None,
-            "file_path": file_paths[best_match_idx] if file_paths[best_match_idx] else None,
-            "similarity": float(max_similarity),
-            "category": category_tfidf,
-            "is_shortcut": False,
-            "method": "tfidf",
-            "source": "local"
-        }
+def get_responses(queries, user_id, allow_external=True, deadline=None, count=True):
+    """Answer a batch of queries.
 
-    # FastText approach
-    ft_idx, ft_sim = get_best_match_with_fasttext(user_input)
-    if ft_sim > 0.8:
-        return {
-            "answer": responses[ft_idx],
-            "url": f"https://isetsf.rnu.tn{urls[ft_idx]}" if urls[ft_idx] else None,
-            "file_path": file_paths[ft_idx] if file_paths[ft_idx] else None,
-            "similarity": float(ft_sim),
-            "category": category_tfidf,
-            "is_shortcut": False,
-            "method": "fasttext",
-            "source": "local"
-        }
+    Each stage of the cascade runs once over all the queries still
+    unresolved, as a single matrix operation, so only the misses of a stage
+    reach the next one. The whole batch is answered from one knowledge
+    snapshot, even if another one is swapped in meanwhile. The external API
+    only gets what is left of the deadline, a new request budget by default.
+    With count=False the responses are left out of RESPONSES, for a caller
+    that may still answer them another way and counts the final response.
+    """
+    deadline = deadline or llm_client.Deadline(LLM_CLIENT["request_budget"])
+    results = []
+    with snapshots.use() as snapshot:
+        for start in range(0, len(queries), BATCH_CHUNK_SIZE):
+            results.extend(_answer_chunk(snapshot, queries[start:start + BATCH_CHUNK_SIZE], user_id, allow_external,
+                                         deadline, count))
+    return results
 
-    # KNN approach
-    distances, indices = knn_classifier.kneighbors(input_dense, n_neighbors=1)
-    if distances[0][0] < 0.7:
-        idx = indices[0][0]
-        category_knn = nb_classifier.predict(input_tfidf)[0]
-        return {
-            "answer": responses[idx],
-            "url": f"https://isetsf.rnu.tn{urls[idx]}" if urls[idx] else None,
-            "file_path": file_paths[idx] if file_paths[idx] else None,
-            "similarity": float(1.0 - distances[0][0]),
-            "category": category_knn,
-            "is_shortcut": False,
-            "method": "knn",
-            "source": "local"
-        }
+def _answer_chunk(snapshot, queries, user_id, allow_external, deadline, count):
+    # Milliseconds spent per stage on each query, batch stages counted in full for every query they saw
+    query_timings = [{} for _ in queries]
+    batch_timings = {}
+    results = [_local_response(query, user_id, query_timings[i]) for i, query in enumerate(queries)]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        _retrieve_chunk(snapshot, queries, user_id, allow_external, deadline, results, pending, query_timings,
+                        batch_timings)
+    for i, result in enumerate(results):
+        if count:
+            RESPONSES.inc(method=result["method"])
+        if DEBUG_TIMINGS:
+            result["timings"] = {stage: round(ms, 3) for stage, ms in query_timings[i].items()}
+    return results
+
+def _retrieve_chunk(snapshot, queries, user_id, allow_external, deadline, results, pending, query_timings,
+                    batch_timings):
+    # Hybrid retrieval, a single decision on the fused best candidate
+    best_candidates, categories_tfidf, input_vectors = _rank(
+        snapshot, [queries[i] for i in pending], batch_timings, deadline)
+    unresolved = []
+    for pos, i in enumerate(pending):
+        best = best_candidates[pos]
+        if best and best["similarity"] >= RETRIEVAL["min_similarity"]:
+            results[i] = _entry_response(snapshot, best["entry_id"], best["similarity"], categories_tfidf[pos], "hybrid")
+            results[i]["signals"] = best["signals"]
+            query_timings[i].update(batch_timings)
+        else:
+            unresolved.append(pos)
+    count_results("hybrid", len(pending) - len(unresolved), len(unresolved))
 
     # Index search fallback
-    search_result = search_in_index(user_input)
-    if search_result:
-        return {
-            "answer": search_result['answer'],
-            "url": f"https://isetsf.rnu.tn{search_result['url']}" if search_result['url'] else None,
-            "similarity": 0.5,
-            "category": category_tfidf,
-            "is_shortcut": False,
-            "method": "index_search",
-            "source": "local"
-        }
+    if unresolved:
+        with timed("index_search", batch_timings):
+            search_results = search_in_index_batch([queries[pending[pos]] for pos in unresolved])
+        remaining = []
+        for pos, search_result in zip(unresolved, search_results):
+            query_timings[pending[pos]].update(batch_timings)
+            if search_result:
+                results[pending[pos]] = {
+                    "answer": search_result['answer'],
+                    "url": f"https://isetsf.rnu.tn{search_result['url']}" if search_result['url'] else None,
+                    "similarity": 0.5,
+                    "category": categories_tfidf[pos],
+                    "is_shortcut": False,
+                    "method": "index_search",
+                    "source": "local"
+                }
+            else:
+                remaining.append(pos)
+        count_results("index_search", len(unresolved) - len(remaining), len(remaining))
+        unresolved = remaining
+
+    # Answers the external API already gave, to any user
+    remaining = []
+    for pos in unresolved:
+        user_input = queries[pending[pos]]
+        with timed("answer_cache", query_timings[pending[pos]]):
+            response_dict = cached_response(user_input, input_vectors[pos])
+        if response_dict:
+            save_new_question(user_input, response_dict, user_id=user_id)
+            results[pending[pos]] = response_dict
+        else:
+            remaining.append(pos)
+    count_results("answer_cache", len(unresolved) - len(remaining), len(remaining))
+    unresolved = remaining
 
     # OpenRouter API fallback
-    api_response = call_openrouter_api(user_input)
-    response_dict = {
-        "answer": api_response,
+    for pos in unresolved:
+        user_input = queries[pending[pos]]
+        if not allow_external:
+            results[pending[pos]] = {
+                "answer": None,
+                "url": None,
+                "similarity": 0.0,
+                "category": "unresolved",
+                "is_shortcut": False,
+                "method": "unresolved",
+                "source": "local"
+            }
+            continue
+        with timed("external_api", query_timings[pending[pos]]):
+            answer = call_openrouter_api(user_input, deadline)
+        count_results("external_api", answer is not None, answer is None)
+        if answer is None:
+            results[pending[pos]] = degraded_response(snapshot, best_candidates[pos], categories_tfidf[pos])
+            continue
+        answer_cache.put(user_input, answer, input_vectors[pos])
+        response_dict = external_response(answer)
+        save_new_question(user_input, response_dict, user_id=user_id)
+        results[pending[pos]] = response_dict
+
+def _rank(snapshot, queries, timings, deadline=None):
+    """Rank through the retrieval service if there is one and it answers before the deadline, locally otherwise."""
+    if retrieval_client:
+        try:
+            with timed("retrieval_service", timings):
+                best_candidates, categories, vectors = retrieval_client.rank(
+                    snapshot.version, queries, timings, deadline.remaining() if deadline else None,
+                    updates=live_index.version)
+            if any(best and best["entry_id"] >= len(snapshot.knowledge_base) for best in best_candidates):
+                # The service read entries rated since this process last did
+                live_index.catch_up()
+            # Deleted here since the service last read the update log
+            deleted = snapshot.knowledge_base.deleted
+            return [None if best and best["entry_id"] in deleted else best for best in best_candidates], categories, vectors
+        except RetrievalUnavailable:
+            pass
+    return rank(snapshot, queries, timings)
+
+def external_response(answer):
+    """Response dict for an answer generated by the external API."""
+    return {
+        "answer": answer,
         "url": None,
         "similarity": 0.0,
         "category": "external_api",
@@ -180,37 +327,104 @@ def get_response(user_input, user_id):
         "method": "External Chatbot",
         "source": "local"
     }
-    save_new_question(user_input, response_dict, user_id=user_id)
-    return response_dict
+
+def degraded_response(snapshot, best, category):
+    """Best local answer for a query the external API could not answer.
+
+    The closest entry if it is close enough to be worth showing, an apology
+    otherwise. Degraded answers are neither cached nor saved, so the query
+    reaches the API again next time.
+    """
+    if best and best["similarity"] >= LLM_CLIENT["fallback_min_similarity"]:
+        response = _entry_response(snapshot, best["entry_id"], best["similarity"], category, "local_fallback")
+    else:
+        response = external_response(API_ERROR_ANSWER)
+        response["method"] = "external_unavailable"
+    response["degraded"] = True
+    return response
+
+def apply_rating(question, answer, positive, user_id=None):
+    """Log a rating for every process and make it visible to retrieval here at once.
+
+    Returns True if the knowledge base changed. Raises if the rating could
+    not be logged.
+    """
+    if positive:
+        live_index.upsert(question, answer, user_id)
+        changed = True
+    else:
+        changed = live_index.delete(question, user_id)
+    if changed:
+        # A cached external answer may now be shadowed by the knowledge base
+        answer_cache.invalidate(_kb_version())
+    return changed
+
+def cached_response(user_input, vector):
+    """Response dict for a cached external answer, or None on a miss."""
+    cached = answer_cache.get(user_input, vector)
+    if cached is None:
+        return None
+    answer, similarity = cached
+    response = external_response(answer)
+    response["similarity"] = similarity
+    response["method"] = "answer_cache"
+    return response
+
+def stream_response(user_input, user_id):
+    """Answer like get_response, streaming the OpenRouter fallback.
+
+    Yields ("token", text) pairs while the external answer arrives, then a
+    single ("done", response) pair. Local answers only yield "done". The
+    response of a stream cut short is marked "incomplete".
+    """
+    deadline = llm_client.Deadline(LLM_CLIENT["request_budget"])
+    response = get_responses([user_input], user_id, allow_external=False, deadline=deadline, count=False)[0]
+    if response["method"] != "unresolved":
+        RESPONSES.inc(method=response["method"])
+        yield "done", response
+        return
+
+    tokens = []
+    complete = False
+    began = time.perf_counter()
+    try:
+        for token in llm_client.stream_completion(user_input, deadline):
+            tokens.append(token)
+            yield "token", token
+        complete = True
+    except llm_client.ExternalUnavailable:
+        pass
+    except requests.RequestException as e:
+        print(f"OpenRouter API stream failed: {e}")
+    # Time to the last token, the client consuming the stream included
+    STAGE_SECONDS.observe(time.perf_counter() - began, stage="external_api_stream")
+    count_results("external_api_stream", complete, not complete)
+    answer = ''.join(tokens).strip()
+    if not answer:
+        with snapshots.use() as snapshot:
+            best_candidates, categories, _ = _rank(snapshot, [user_input], None, deadline)
+            response = degraded_response(snapshot, best_candidates[0], categories[0])
+        RESPONSES.inc(method=response["method"])
+        yield "done", response
+        return
+    response = external_response(answer)
+    RESPONSES.inc(method=response["method"])
+    # A stream cut short is shown to this user but neither cached nor saved
+    if complete:
+        with snapshots.use() as snapshot:
+            vector = snapshot.retriever.encode([preprocess_text(user_input)])[1][0]
+        answer_cache.put(user_input, answer, vector)
+        save_new_question(user_input, response, user_id=user_id)
+    else:
+        response["incomplete"] = True
+    yield "done", response
 
 def save_new_question(user_input, response, rating=None, user_id=None):
-    """Save new questions and responses to a file."""
+    """Save a new question and its response for the user."""
     try:
-        if not os.path.exists("data"):
-            os.makedirs("data")
-        
-        if os.path.exists('data/new_questions.json'):
-            with open('data/new_questions.json', 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        entry = json.loads(line)
-                        if entry['question'].lower() == user_input.lower() and entry['user_id'] == user_id:
-                            return True
-        
         answer = response.get('answer') if isinstance(response, dict) else response
-        entry = {
-            "question": user_input,
-            "response": answer,
-            "rating": rating,
-            "user_id": user_id,
-            "timestamp": pd.Timestamp.now().isoformat()
-        }
-        
-        with open('data/new_questions.json', 'a', encoding='utf-8') as f:
-            json.dump(entry, f, ensure_ascii=False)
-            f.write('\n')
-            
+        question_store.save(user_id, user_input, answer, rating=rating)
         return True
     except Exception as e:
         print(f"Error saving question: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -20,21 +20,146 @@ shortcut_urls = {
 }
 
 MODEL_PATHS = {
-    "fasttext": "models/fasttext.model",
-    "nb_classifier": "models/nb_classifier.pkl",
-    "knn_classifier": "models/knn_classifier.pkl",
-    "vectorizer": "models/vectorizer.pkl"
+    "fasttext": "models/fasttext.model"
 }
 
-SIMILARITY_THRESHOLDS = {
-    "tfidf": 0.65,
-    "fasttext": 0.8,
-    "knn": 0.7
+# Hybrid retrieval: every signal returns its top k, fused by "weighted" or
+# "rrf". The best candidate is answered if its weighted similarity reaches
+# min_similarity, otherwise the query falls through to the index search.
+RETRIEVAL = {
+    "k": 10,
+    "dense_oversample": 4,
+    "fusion": "weighted",
+    "weights": {"tfidf": 0.5, "fasttext": 0.3, "knn": 0.2},
+    "rrf_k": 60,
+    "min_similarity": 0.45
 }
 
+# Dense embedding search, "auto" switches from exact to IVF at ivf_min_rows
+VECTOR_INDEX = {
+    "backend": "auto",
+    "ivf_min_rows": 100000,
+    "n_probe": 16
+}
+
+# Queries answered together by get_responses, and the cap of /api/chat/batch
+BATCH_CHUNK_SIZE = 256
+BATCH_MAX_QUERIES = 5000
+
+# Chat history is rendered and fetched this many messages, and the sidebar
+# this many sessions, at a time
+HISTORY_PAGE_SIZE = 30
+HISTORY_MAX_PAGE_SIZE = 100
+SESSIONS_PAGE_SIZE = 50
+
+# Set on every connection to the chat database. WAL lets readers run while
+# a batch commits, and synchronous=NORMAL only syncs at checkpoints.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -20000,
+    "temp_store": "MEMORY"
+}
+
+# Write-behind mode: chat messages are queued and committed in batches of at
+# most batch_size by a background thread, every flush_interval seconds. A
+# batch failing max_attempts flushes in a row is written message by message
+# and the messages still failing go to dead_letter_path.
+CHAT_WRITE_BEHIND = {
+    "enabled": os.getenv('CHAT_WRITE_BEHIND', '0') == '1',
+    "batch_size": 500,
+    "flush_interval": 0.05,
+    "max_attempts": 5,
+    "dead_letter_path": "data/chat_dead_letter.jsonl"
+}
+
+# Rendered public shared-chat pages kept in memory, served while their
+# session has no new message
+SHARED_PAGE_CACHE_SIZE = 256
+
+# Cross-user cache of external API answers. A query hits on its normalized
+# text or on a cached query whose FastText cosine reaches min_similarity.
+ANSWER_CACHE = {
+    "path": "data/answer_cache.db",
+    "max_entries": 10000,
+    "ttl_seconds": 7 * 24 * 3600,
+    "min_similarity": 0.92
+}
+
+# Rated answers are searchable at once through delta segments, merged in
+# the background every compact_interval seconds once they hold compact_rows.
+# Each process reads the answers rated by the others every poll_interval seconds.
+LIVE_UPDATES = {
+    "compact_rows": 1000,
+    "compact_interval": 60,
+    "poll_interval": 1.0
+}
+
+# OpenRouter calls. A request has request_budget seconds for the whole
+# cascade and the external API gets what is left, in at most max_attempts
+# tries with jittered exponential backoff, none started with less than
+# min_attempt_seconds left. After failure_threshold failures in a row the
+# circuit opens and calls fail at once for reset_timeout seconds, then a
+# single call probes the API. A query the API could not answer gets the
+# closest knowledge-base entry if it scores fallback_min_similarity.
+LLM_CLIENT = {
+    "request_budget": 8.0,
+    "connect_timeout": 2.0,
+    "stream_idle_timeout": 10.0,
+    "max_attempts": 3,
+    "min_attempt_seconds": 0.5,
+    "backoff_base": 0.25,
+    "backoff_max": 2.0,
+    "failure_threshold": 5,
+    "reset_timeout": 30.0,
+    "fallback_min_similarity": 0.25
+}
+
+# Out-of-process hybrid retrieval, see chatbot/retrieval_service.py. The
+# service listens on the Unix socket at address and web processes rank
+# through it when it is set. Each web process sends at most connections
+# batches of at most max_batch queries at a time, and ranks locally when
+# the service does not answer within timeout seconds.
+RETRIEVAL_SERVICE = {
+    "address": os.getenv('RETRIEVAL_SERVICE_ADDRESS'),
+    "workers": int(os.getenv('RETRIEVAL_SERVICE_WORKERS', 0)) or os.cpu_count(),
+    "connections": 4,
+    "max_batch": 64,
+    "timeout": 5.0
+}
+
+# Metrics shared by the processes of a pre-forking server: each writes its
+# own to directory every write_interval seconds and /metrics serves the sum.
+# gunicorn.conf.py sets METRICS_DIR, unset keeps metrics per process.
+SHARED_METRICS = {
+    "directory": os.getenv('METRICS_DIR'),
+    "write_interval": 1.0
+}
+
+# Attach the milliseconds spent in each stage of the cascade to every
+# response, under "timings"
+DEBUG_TIMINGS = os.getenv('DEBUG_TIMINGS', '0') == '1'
+
+# Seconds between checks for a newly published artifact bundle, 0 disables
+# the watch and only the admin reload endpoint swaps snapshots
+SNAPSHOT_WATCH_INTERVAL = 5
+
 DATA_PATH = "data/data.json"
 NEW_QUESTIONS_PATH = "data/new_questions.json"
+NEW_QUESTIONS_DB_PATH = "data/new_questions.db"
+KB_UPDATES_DB_PATH = "data/kb_updates.db"
 INDEX_DIR = "indexdir"
+ARTIFACTS_DIR = "models/kb"
+TRAINED_MODELS_DIR = "models/trained"
+
+# Token expected in the X-Admin-Token header of admin endpoints, unset disables them
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Enables POST /loadtest/login, which logs in users of LOADTEST_EMAIL_DOMAIN
+# without Google for the load-test driver. Never set it in production.
+LOADTEST_LOGIN = os.getenv('LOADTEST_LOGIN', '0') == '1'
+LOADTEST_EMAIL_DOMAIN = "loadtest.invalid"
 
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
\ No newline at end of file
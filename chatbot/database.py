@@ -1,8 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, func, inspect, text
+from sqlalchemy.schema import CreateTable
 
 db = SQLAlchemy()
 
+TITLE_LENGTH = 40
+
+# Keys of a response dict stored in their own ChatMessage column, the others go to `extra`
+RESPONSE_COLUMNS = ("answer", "method", "similarity", "category", "url")
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -12,20 +19,239 @@ class User(UserMixin, db.Model):
         return str(self.id)
 
 class ChatSession(db.Model):
+    # Sessions are listed per user, newest first, with an id cursor
+    __table_args__ = (db.Index('ix_chat_session_user_id_id', 'user_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
-    date = db.Column(db.String(50), nullable=False)
-    messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
+    date = db.Column(db.DateTime, nullable=False)
+    # Denormalized by add_message, so listing sessions never reads their messages
+    title = db.Column(db.String(TITLE_LENGTH + 3), nullable=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=True)
+    messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan',
+                               order_by='ChatMessage.id')
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "date": self.date.isoformat(),
+            "title": self.title or default_title(self.date),
+            "message_count": self.message_count,
+            "updated_at": (self.updated_at or self.date).isoformat()
+        }
 
 class ChatMessage(db.Model):
+    # History is paged per session with a message id cursor
+    __table_args__ = (db.Index('ix_chat_message_session_id_id', 'session_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id', ondelete='CASCADE'), nullable=False)
     user_message = db.Column(db.Text, nullable=False)
-    bot_response = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.String(50), nullable=False)
+    answer = db.Column(db.Text, nullable=True)
+    method = db.Column(db.String(50), nullable=True)
+    similarity = db.Column(db.Float, nullable=True)
+    category = db.Column(db.String(100), nullable=True)
+    url = db.Column(db.Text, nullable=True)
+    # The other keys of the response, e.g. file_path, is_shortcut or signals
+    extra = db.Column(db.JSON, nullable=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    @property
+    def bot_response(self):
+        """The response dict the message was stored from."""
+        response = {key: getattr(self, key) for key in RESPONSE_COLUMNS}
+        response.update(self.extra or {})
+        return response
+
+    @bot_response.setter
+    def bot_response(self, response):
+        for key, value in response_columns(response).items():
+            setattr(self, key, value)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_message': self.user_message,
+            'bot_response': self.bot_response,
+            'timestamp': self.timestamp.isoformat()
+        }
 
 class SharedChat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(64), unique=True, nullable=False)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id', ondelete='CASCADE'), nullable=False)
-    created_at = db.Column(db.DateTime, nullable=False)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, nullable=False)
+
+def session_title(first_message):
+    """Title of a session named after its first message, or None if that is blank."""
+    first_message = (first_message or '').strip()
+    if not first_message:
+        return None
+    return first_message[:TITLE_LENGTH] + ('...' if len(first_message) > TITLE_LENGTH else '')
+
+def default_title(date):
+    """Title of a session without messages, e.g. Chat_May09."""
+    if date is None:
+        return "Nouveau chat"
+    return f"Chat_{date.strftime('%b')}{date.day:02d}"
+
+def response_columns(response):
+    """ChatMessage column values storing a response dict."""
+    columns = {key: response.get(key) for key in RESPONSE_COLUMNS}
+    columns["extra"] = {key: value for key, value in response.items() if key not in RESPONSE_COLUMNS} or None
+    return columns
+
+def add_message(session_id, user_message, bot_response, timestamp):
+    """Add a message to the database session and update the summary of its chat session.
+
+    bot_response is the response dict and timestamp a datetime. Returns the
+    id of the message. The caller commits.
+    """
+    return add_messages([{
+        "session_id": session_id,
+        "user_message": user_message,
+        "bot_response": bot_response,
+        "timestamp": timestamp
+    }])[0]
+
+def add_messages(messages):
+    """Insert messages, dicts of the arguments of add_message, in one statement.
+
+    The summary of each of their sessions is updated once. Counts are
+    incremented in SQL, so concurrent messages to one session are all
+    counted. Returns the ids of the messages in order. The caller commits.
+    """
+    rows = [dict(session_id=message["session_id"], user_message=message["user_message"],
+                 timestamp=message["timestamp"], **response_columns(message["bot_response"]))
+            for message in messages]
+    ids = db.session.execute(
+        db.insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True), rows).scalars().all()
+    summaries = {}
+    for message in messages:
+        summary = summaries.setdefault(message["session_id"], {"count": 0, "title": None})
+        summary["count"] += 1
+        summary["updated_at"] = message["timestamp"]
+        summary["title"] = summary["title"] or session_title(message["user_message"])
+    for session_id, summary in summaries.items():
+        values = {
+            "message_count": ChatSession.message_count + summary["count"],
+            "updated_at": summary["updated_at"]
+        }
+        if summary["title"]:
+            values["title"] = func.coalesce(ChatSession.title, summary["title"])
+        db.session.execute(db.update(ChatSession).where(ChatSession.id == session_id).values(**values))
+    return ids
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Run PRAGMA statements on every new connection of a SQLite engine."""
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+# Columns added to existing tables after their creation, with their DDL
+ADDED_COLUMNS = {
+    "chat_session": [
+        ("title", f"VARCHAR({TITLE_LENGTH + 3})"),
+        ("message_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("updated_at", "DATETIME")
+    ]
+}
+
+def upgrade_schema():
+    """Bring tables created by older versions up to the current models.
+
+    Adds the columns db.create_all does not add to existing tables and
+    backfills them, rebuilds the chat tables still storing dates as strings
+    and responses as JSON text, and creates missing indexes. Returns the
+    changes made.
+    """
+    inspector = inspect(db.engine)
+    added = []
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table)}
+        for name, ddl in columns:
+            if name not in existing:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+                added.append(f"{table}.{name}")
+    if "chat_session.message_count" in added:
+        _backfill_session_summaries()
+    db.session.commit()
+
+    columns = {table: {column["name"]: column["type"] for column in inspect(db.engine).get_columns(table)}
+               for table in ("chat_session", "chat_message")}
+    # Also rebuilt when updated_at was added as a string by an earlier version of this upgrade
+    if not all(isinstance(columns["chat_session"][name], db.DateTime) for name in ("date", "updated_at")):
+        _rebuild_table(ChatSession.__table__, SESSION_COPY)
+        added.append("chat_session")
+    if "bot_response" in columns["chat_message"]:
+        _rebuild_table(ChatMessage.__table__, MESSAGE_COPY)
+        added.append("chat_message")
+    for model in (ChatSession, ChatMessage):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+    return added
+
+# Rows of the legacy tables in the column order of the current ones. ISO dates lose their T to
+# read back as datetimes, and responses that are not JSON objects are kept whole as the answer.
+SESSION_COPY = """
+    SELECT id, user_id, REPLACE(date, 'T', ' '), title, message_count, REPLACE(updated_at, 'T', ' ')
+    FROM {legacy}
+"""
+MESSAGE_COPY = """
+    SELECT id, session_id, user_message,
+        CASE WHEN structured THEN json_extract(bot_response, '$.answer') ELSE bot_response END,
+        CASE WHEN structured THEN json_extract(bot_response, '$.method') END,
+        CASE WHEN structured THEN json_extract(bot_response, '$.similarity') END,
+        CASE WHEN structured THEN json_extract(bot_response, '$.category') END,
+        CASE WHEN structured THEN json_extract(bot_response, '$.url') END,
+        CASE WHEN structured THEN
+            NULLIF(json_remove(bot_response, '$.answer', '$.method', '$.similarity', '$.category', '$.url'), '{{}}')
+        END,
+        REPLACE(timestamp, 'T', ' ')
+    FROM (SELECT *, CASE WHEN json_valid(bot_response) THEN json_type(bot_response) END = 'object' AS structured
+          FROM {legacy})
+"""
+
+def _rebuild_table(table, copy_sql):
+    """Recreate a table from its current model and copy its rows over, in one transaction.
+
+    SQLite cannot change the type of a column, so the table is renamed, created
+    again and filled from copy_sql. Other tables keep referencing it by name.
+    """
+    legacy = f"{table.name}_legacy"
+    connection = db.engine.raw_connection()
+    try:
+        connection.cursor().executescript(f"""
+            PRAGMA legacy_alter_table = ON;
+            BEGIN;
+            ALTER TABLE {table.name} RENAME TO {legacy};
+            {CreateTable(table).compile(dialect=db.engine.dialect)};
+            INSERT INTO {table.name} ({", ".join(table.c.keys())}) {copy_sql.format(legacy=legacy)};
+            DROP TABLE {legacy};
+            COMMIT;
+            PRAGMA legacy_alter_table = OFF;
+        """)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def _backfill_session_summaries():
+    db.session.execute(text("""
+        UPDATE chat_session SET
+            message_count = (SELECT COUNT(*) FROM chat_message WHERE chat_message.session_id = chat_session.id),
+            updated_at = REPLACE(COALESCE(
+                (SELECT MAX(timestamp) FROM chat_message WHERE chat_message.session_id = chat_session.id), date),
+                'T', ' ')
+    """))
+    first_messages = db.session.execute(text("""
+        SELECT session_id, user_message FROM chat_message
+        WHERE id IN (SELECT MIN(id) FROM chat_message GROUP BY session_id)
+    """))
+    for session_id, user_message in first_messages.all():
+        title = session_title(user_message)
+        if title:
+            db.session.execute(db.update(ChatSession).where(ChatSession.id == session_id).values(title=title))
@@ -1,15 +1,17 @@
-from chatbot.data_processing import fasttext_model, get_document_vector_fasttext, fasttext_question_vectors
-import numpy as np
+from chatbot.config import VECTOR_INDEX
+from chatbot.vector_index import DeltaIndex, build_vector_index
 
-def get_best_match_with_fasttext(user_input):
-    """
-    Find the best matching question using FastText embeddings.
-    Returns (best_index, similarity_score)
-    """
-    if fasttext_model is None or fasttext_question_vectors is None:
-        return 0, 0.0
-    input_vec = get_document_vector_fasttext(user_input, fasttext_model)
-    similarities = np.dot(fasttext_question_vectors, input_vec) / (
-        np.linalg.norm(fasttext_question_vectors, axis=1) * np.linalg.norm(input_vec) + 1e-8)
-    best_idx = int(np.argmax(similarities))
-    return best_idx, float(similarities[best_idx]) 
\ No newline at end of file
+def _build_index(vectors):
+    return build_vector_index(
+        vectors,
+        backend=VECTOR_INDEX["backend"],
+        normalized=True,
+        ivf_min_rows=VECTOR_INDEX["ivf_min_rows"],
+        n_probe=VECTOR_INDEX["n_probe"]
+    )
+
+def build_fasttext_index(question_vectors):
+    """Search index over the question vectors, stored unit-normalized by the
+    artifact build. Rows added by live updates are searched exactly until
+    compaction."""
+    return DeltaIndex(question_vectors, _build_index, normalized=True)
@@ -0,0 +1,109 @@
+"""Compact, entry-indexed view of the knowledge base.
+
+Every entry is stored once, whatever its number of question variations.
+Question rows of the TF-IDF matrix and of the vector index map to their
+entry through the int32 `row_to_entry` array.
+
+Live updates append entries and rows, replace an entry in place, or mark it
+deleted. Deleted entries keep their rows but never come out of pool_max.
+"""
+import sys
+import numpy as np
+
+class Entry:
+    """One knowledge-base entry, shared by all of its question variations."""
+    __slots__ = ('question', 'answer', 'url', 'file_path', 'category')
+
+    def __init__(self, question, answer, url='', file_path='', category='general'):
+        self.question = question
+        self.answer = answer
+        self.url = url or ''
+        self.file_path = file_path or ''
+        # Few distinct categories, share one string object per category
+        self.category = sys.intern(category or 'general')
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['question'], data['answer'], data.get('url', ''),
+                   data.get('file_path', ''), data.get('category', 'general'))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class KnowledgeBase:
+    def __init__(self, entries, row_to_entry):
+        self.entries = entries
+        self.row_to_entry = row_to_entry
+        self.deleted = frozenset()
+        self._by_question = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, entry_id):
+        return self.entries[entry_id]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def n_rows(self):
+        return len(self.row_to_entry)
+
+    def row_categories(self):
+        """Category label of every question row."""
+        return [self.entries[entry_id].category for entry_id in self.row_to_entry]
+
+    def find(self, question):
+        """Entry id of the entry asking question, ignoring case, or None."""
+        if self._by_question is None:
+            self._by_question = {entry.question.strip().lower(): entry_id
+                                 for entry_id, entry in enumerate(self.entries)}
+        return self._by_question.get(question.strip().lower())
+
+    def append(self, entry, n_rows=1):
+        """Add an entry owning the next n_rows rows; return its id."""
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        # Replace rather than resize, searches holding the old array stay valid
+        self.row_to_entry = np.concatenate([self.row_to_entry, np.full(n_rows, entry_id, dtype=np.int32)])
+        if self._by_question is not None:
+            self._by_question[entry.question.strip().lower()] = entry_id
+        return entry_id
+
+    def replace(self, entry_id, entry):
+        """Swap the content of an entry whose question is unchanged."""
+        self.entries[entry_id] = entry
+        self.deleted = self.deleted - {entry_id}
+
+    def delete(self, entry_id):
+        self.deleted = self.deleted | {entry_id}
+
+    def pool_max(self, rows, scores, k=None):
+        """Max-pool row scores per entry.
+
+        Returns (entry_ids, scores) arrays, best first, limited to the top k
+        entries, so several variations of one entry take a single slot.
+        """
+        rows = np.asarray(rows)
+        scores = np.asarray(scores, dtype=np.float32)
+        keep = scores > 0
+        rows, scores = rows[keep], scores[keep]
+        entry_ids = np.asarray(self.row_to_entry[rows])
+        deleted = self.deleted
+        if deleted:
+            keep = ~np.isin(entry_ids, list(deleted))
+            entry_ids, scores = entry_ids[keep], scores[keep]
+        if not len(entry_ids):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        # Group by entry with the best score first, then keep the first of each group
+        order = np.lexsort((-scores, entry_ids))
+        entry_ids, scores = entry_ids[order], scores[order]
+        first = np.ones(len(entry_ids), dtype=bool)
+        first[1:] = entry_ids[1:] != entry_ids[:-1]
+        entry_ids, scores = entry_ids[first], scores[first]
+        if k is not None and len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            entry_ids, scores = entry_ids[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return entry_ids[order], scores[order]
@@ -0,0 +1,148 @@
+"""Knowledge-base updates applied to the serving indexes without a restart.
+
+A rated answer is appended to the shared UpdateLog, then goes into the
+knowledge base, the TF-IDF and FastText delta segments and the Whoosh
+index at once, so it is searchable on the next request. Other processes
+read it from the log within poll_interval seconds; they update their own
+knowledge base and delta segments, the Whoosh index on disk is shared.
+A new snapshot gets the rows newer than its bundle replayed before it is
+swapped in, Whoosh included, so a restart or a swap loses nothing. The
+fitted vocabulary does not grow: words the vectorizer never saw only count
+through FastText until the offline build folds the log into data.json.
+
+A background thread merges the delta segments into the base ones once they
+hold compact_rows rows, and merges the small Whoosh segments left by the
+updates.
+"""
+import threading
+import time
+from chatbot.knowledge_base import Entry
+from chatbot.preprocessing import preprocess_text
+from chatbot.search_index import update_entry, delete_entry, merge_segments
+
+class LiveIndex:
+    def __init__(self, log, ix=None, compact_rows=1000, compact_interval=60, poll_interval=1.0):
+        self.log = log
+        # None where the full-text index is not served, e.g. in the retrieval service
+        self.ix = ix
+        self.retriever = None
+        self.compact_rows = compact_rows
+        self.compact_interval = compact_interval
+        self.poll_interval = poll_interval
+        # Id of the last log row applied to the current retriever
+        self.version = 0
+        self._lock = threading.Lock()
+        self._index_updates = 0
+        self._threads = {}
+
+    def replay(self, retriever, since):
+        """Apply the log rows after since to retriever, e.g. of a snapshot not served yet; return the last id."""
+        with self._lock:
+            for row_id, op, question, answer in self.log.since(since):
+                self._apply(retriever, op, question, answer, full_text=True)
+                since = row_id
+        return since
+
+    def attach(self, retriever, version):
+        """Apply further updates to retriever, to which the log was replayed up to version."""
+        with self._lock:
+            self.retriever = retriever
+            self.version = version
+        self.catch_up()
+
+    def catch_up(self, full_text=False):
+        """Apply the rows logged since the last one applied; return True if any was.
+
+        Rows logged by other processes are already in the shared Whoosh index,
+        full_text writes them there again anyway.
+        """
+        with self._lock:
+            rows = self.log.since(self.version)
+            for row_id, op, question, answer in rows:
+                self._apply(self.retriever, op, question, answer, full_text)
+                self.version = row_id
+        return bool(rows)
+
+    def upsert(self, question, answer, user_id=None):
+        """Log and apply the entry asking question with answer, added or replacing its answer."""
+        self.log.append('upsert', question, answer, user_id)
+        self.catch_up(full_text=True)
+
+    def delete(self, question, user_id=None):
+        """Log and apply the removal of the entry asking question; return False if there is none."""
+        knowledge_base = self.retriever.knowledge_base
+        entry_id = knowledge_base.find(question)
+        if entry_id is None or entry_id in knowledge_base.deleted:
+            return False
+        self.log.append('delete', question, user_id=user_id)
+        self.catch_up(full_text=True)
+        return True
+
+    def _apply(self, retriever, op, question, answer, full_text):
+        knowledge_base = retriever.knowledge_base
+        entry_id = knowledge_base.find(question)
+        if op == 'delete':
+            if entry_id is None:
+                return
+            knowledge_base.delete(entry_id)
+            if full_text and self.ix is not None:
+                delete_entry(self.ix, knowledge_base[entry_id])
+        else:
+            if entry_id is not None:
+                old = knowledge_base[entry_id]
+                entry = Entry(old.question, answer, old.url, old.file_path, old.category)
+                knowledge_base.replace(entry_id, entry)
+            else:
+                entry = Entry(question.strip(), answer, category='user_rated')
+                X, V = retriever.encode([preprocess_text(entry.question)])
+                # Rows must map to their entry before any index can return them
+                knowledge_base.append(entry)
+                retriever.sparse_index.append(X, knowledge_base.row_to_entry)
+                retriever.dense_index.add(V)
+            if full_text and self.ix is not None:
+                update_entry(self.ix, entry)
+        self._index_updates += 1
+
+    def pending_rows(self):
+        return max(self.retriever.sparse_index.n_delta, self.retriever.dense_index.n_delta)
+
+    def compact(self):
+        """Merge the delta segments and the Whoosh segments written by updates."""
+        self.retriever.sparse_index.compact()
+        self.retriever.dense_index.compact()
+        if self._index_updates and self.ix is not None:
+            self._index_updates = 0
+            merge_segments(self.ix)
+
+    def _compaction_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            if self.pending_rows() < self.compact_rows and self._index_updates < self.compact_rows:
+                continue
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting live updates: {e}")
+
+    def _poll_loop(self, on_change):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                if self.catch_up() and on_change:
+                    on_change()
+            except Exception as e:
+                print(f"Error reading knowledge-base updates: {e}")
+
+    def start_compaction(self):
+        """Compact on a background thread every compact_interval seconds if needed."""
+        return self._start("kb-compaction", self._compaction_loop)
+
+    def start_polling(self, on_change=None):
+        """Apply the rows other processes log every poll_interval seconds, calling on_change() after any."""
+        return self._start("kb-updates", self._poll_loop, on_change)
+
+    def _start(self, name, target, *args):
+        if name not in self._threads:
+            self._threads[name] = threading.Thread(target=target, args=args, name=name, daemon=True)
+            self._threads[name].start()
+        return self._threads[name]
@@ -0,0 +1,248 @@
+"""OpenRouter chat-completions client over a pooled keep-alive session.
+
+Set OPENROUTER_API_URL to point the client at another server, e.g. a local
+mock while testing.
+
+Calls are bounded by the Deadline of the request they serve. Timeouts,
+connection errors, 429 and 5xx responses are retried with jittered
+backoff while time is left, as are 200 responses whose body cannot be
+read in time or parsed, and counted by a per-process CircuitBreaker
+which, once open, fails calls at once instead of letting every request
+wait on an API that is down. Calls not sent raise ExternalUnavailable.
+"""
+import json
+import os
+import random
+import threading
+import time
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from chatbot.config import LLM_CLIENT
+from chatbot.metrics import EXTERNAL_ATTEMPTS
+
+# Load environment variables for API key
+load_dotenv()
+API_KEY = os.getenv('OPENROUTER_API_KEY')
+API_URL = os.getenv('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+MODEL = 'meta-llama/llama-3.1-8b-instruct:free'
+# Worth another try, the API may answer them next time
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+class ExternalUnavailable(requests.RequestException):
+    """The API was not called: its circuit is open or the request is out of time."""
+
+class Deadline:
+    """When a request must be answered by, set when it arrives."""
+    def __init__(self, budget):
+        self.expires = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+class CircuitBreaker:
+    """Opens after failure_threshold failures in a row and then fails calls at once.
+
+    After reset_timeout seconds the circuit is half-open: a single call
+    probes the API, closing the circuit if it succeeds and opening it again
+    if it fails.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        """Whether a call may be made now. An allowed call must record its success or failure."""
+        with self._lock:
+            state = self._state()
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("OpenRouter circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                print(f"OpenRouter circuit opened after {self.failures} failures in a row")
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker(LLM_CLIENT["failure_threshold"], LLM_CLIENT["reset_timeout"])
+
+def _new_session():
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+    session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+    return session
+
+# One session per process, connections are kept alive and reused
+session = _new_session()
+
+def reset_session():
+    """Start a new connection pool, e.g. in a forked worker, which must not share its parent's sockets."""
+    global session
+    session = _new_session()
+
+def _headers():
+    return {
+        'Authorization': f'Bearer {API_KEY}',
+        'Content-Type': 'application/json',
+        'HTTP-Referer': 'http://localhost:8080',
+        'X-Title': 'ISBOT'
+    }
+
+def _payload(query, stream=False):
+    payload = {
+        'model': MODEL,
+        'messages': [
+            {'role': 'system', 'content': 'You are a helpful assistant.'},
+            {'role': 'user', 'content': query}
+        ]
+    }
+    if stream:
+        payload['stream'] = True
+    return payload
+
+def _post(payload, deadline=None, stream=False, read=None):
+    """POST payload, retrying while the deadline allows; return the successful response.
+
+    With read, the body is read by read(response) within the same attempt
+    and its result returned instead. A body it cannot read or parse counts
+    as a failed attempt. Raises requests.RequestException.
+    """
+    deadline = deadline or Deadline(LLM_CLIENT["request_budget"])
+    error = None
+    for attempt in range(LLM_CLIENT["max_attempts"]):
+        remaining = deadline.remaining()
+        if remaining < LLM_CLIENT["min_attempt_seconds"]:
+            EXTERNAL_ATTEMPTS.inc(outcome="deadline")
+            raise error or ExternalUnavailable("No time left to call the OpenRouter API")
+        if not breaker.allow():
+            EXTERNAL_ATTEMPTS.inc(outcome="short_circuit")
+            raise error or ExternalUnavailable("OpenRouter circuit open")
+        # A stream only has to start within the deadline, then each chunk within the idle timeout
+        read_timeout = min(remaining, LLM_CLIENT["stream_idle_timeout"]) if stream and read is None else remaining
+        try:
+            response = session.post(API_URL, json=payload, headers=_headers(), stream=stream or read is not None,
+                                    timeout=(min(LLM_CLIENT["connect_timeout"], remaining), read_timeout))
+            if response.ok and read is not None:
+                with response:
+                    result = read(response)
+        except requests.RequestException as e:
+            error = e
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            error = requests.RequestException(f"Malformed response from the OpenRouter API: {e!r}")
+        else:
+            if response.ok:
+                breaker.record_success()
+                EXTERNAL_ATTEMPTS.inc(outcome="success")
+                return response if read is None else result
+            error = requests.HTTPError(f"{response.status_code} {response.reason} from the OpenRouter API",
+                                       response=response)
+            response.close()
+            if response.status_code not in RETRY_STATUSES:
+                # The API is up, it refused this request
+                breaker.record_success()
+                EXTERNAL_ATTEMPTS.inc(outcome="rejected")
+                raise error
+        breaker.record_failure()
+        EXTERNAL_ATTEMPTS.inc(outcome="failure")
+        if attempt + 1 < LLM_CLIENT["max_attempts"]:
+            # Full jitter, so workers retrying together do not hit the API in step
+            delay = random.uniform(0, min(LLM_CLIENT["backoff_max"], LLM_CLIENT["backoff_base"] * 2 ** attempt))
+            if delay > deadline.remaining() - LLM_CLIENT["min_attempt_seconds"]:
+                break
+            time.sleep(delay)
+    raise error
+
+def _set_read_timeout(response, seconds):
+    # The timeout given to requests bounds each socket read, not the whole body
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is not None:
+        sock.settimeout(max(seconds, 0.001))
+
+def _read_json(response, deadline):
+    """The body of response parsed as JSON, all of it read before the deadline."""
+    body = []
+    try:
+        while True:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise requests.Timeout("OpenRouter response not read within the deadline")
+            # One socket read at a time, each given what is left of the deadline,
+            # decompressed like requests would, e.g. for Content-Encoding: gzip
+            _set_read_timeout(response, remaining)
+            chunk = response.raw.read1(16384, decode_content=True)
+            if not chunk:
+                break
+            body.append(chunk)
+    except urllib3.exceptions.ReadTimeoutError as e:
+        raise requests.Timeout(f"OpenRouter response not read within the deadline: {e}")
+    except (urllib3.exceptions.HTTPError, OSError) as e:
+        raise requests.ConnectionError(f"Reading the OpenRouter response failed: {e}")
+    return json.loads(b''.join(body))
+
+def complete(query, deadline=None):
+    """Return the whole completion for query. Raises requests.RequestException."""
+    deadline = deadline or Deadline(LLM_CLIENT["request_budget"])
+
+    def read(response):
+        return _read_json(response, deadline)['choices'][0]['message']['content'].strip()
+
+    return _post(_payload(query), deadline, read=read)
+
+def stream_completion(query, deadline=None):
+    """Yield the completion for query piece by piece as the server sends it.
+
+    Raises requests.RequestException, possibly after some pieces were
+    yielded. Only a stream that did not start is retried.
+    """
+    with _post(_payload(query, stream=True), deadline, stream=True) as response:
+        response.encoding = 'utf-8'
+        try:
+            # chunk_size=None hands over data as soon as it arrives
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                # Blank lines separate events, lines starting with ':' are keep-alive comments
+                if not line or line.startswith(':') or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    return
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                if 'error' in chunk:
+                    raise requests.RequestException(f"OpenRouter stream error: {chunk['error']}")
+                choices = chunk.get('choices') or [{}]
+                content = (choices[0].get('delta') or {}).get('content')
+                if content:
+                    yield content
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
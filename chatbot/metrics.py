@@ -0,0 +1,198 @@
+"""Latency histograms and counters, exposed in the Prometheus text format.
+
+Every stage of the answer cascade runs inside timed(stage), which measures
+it with the monotonic perf_counter clock into the chatbot_stage_seconds
+histogram and, when given a dict, adds its milliseconds to it so the caller
+can attach them to a response. Stages that can answer a query count their
+hits and misses in chatbot_stage_results_total, and every response counts
+its method in chatbot_responses_total, which shows how often queries fall
+through to the external API.
+
+Metrics are kept per process. Under a pre-forking server, share_metrics()
+has each worker write its own to a file of a shared directory every
+interval seconds, and render() serves the sum over every file, those of
+exited workers included, so counters never go back between scrapes. The
+other workers' values are then up to interval seconds old.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def collect(self):
+        """Values of this process, as JSON-serializable [labels, value] pairs."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, collected):
+        """Text lines of the sum of collected, a list of collect() results."""
+        values = {}
+        for samples in collected:
+            for key, value in samples:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label values: counts per bucket (not cumulative), sum and count
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        """Series of this process, as JSON-serializable [labels, counts, sum, count] lists."""
+        with self._lock:
+            return [[list(key), list(counts), total, count] for key, (counts, total, count) in self._series.items()]
+
+    def render(self, collected):
+        """Text lines of the sum of collected, a list of collect() results."""
+        series = {}
+        for samples in collected:
+            for key, counts, total, count in samples:
+                merged = series.setdefault(tuple(key), [[0] * len(self.buckets), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labelnames + ("le",), key + (repr(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Time spent in each stage of the answer cascade.", ["stage"])
+STAGE_RESULTS = Counter("chatbot_stage_results_total", "Queries a stage answered (hit) or passed on (miss).",
+                        ["stage", "result"])
+RESPONSES = Counter("chatbot_responses_total", "Responses by the method that produced them.", ["method"])
+EXTERNAL_ATTEMPTS = Counter("chatbot_external_api_attempts_total",
+                            "Calls to the external API by outcome, short_circuit and deadline ones not sent.",
+                            ["outcome"])
+METRICS = [STAGE_SECONDS, STAGE_RESULTS, RESPONSES, EXTERNAL_ATTEMPTS]
+
+@contextmanager
+def timed(stage, timings=None):
+    """Time the block as stage, adding its milliseconds to timings if given."""
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - began
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed * 1000
+
+def count_results(stage, hits, misses):
+    if hits:
+        STAGE_RESULTS.inc(hits, stage=stage, result="hit")
+    if misses:
+        STAGE_RESULTS.inc(misses, stage=stage, result="miss")
+
+# File this process writes its metrics to, once share_metrics() was called
+_shared_path = None
+
+def _collect():
+    return {metric.name: metric.collect() for metric in METRICS}
+
+def _write_shared():
+    # Written whole then renamed, so render() never reads half a file
+    temporary = _shared_path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(_collect(), f)
+    os.replace(temporary, _shared_path)
+
+def share_metrics(directory, interval):
+    """Write this process's metrics to directory every interval seconds, for render() in any process.
+
+    Call it once per process, after forking. The file is named after the
+    pid and start time, so a later process reusing the pid does not
+    overwrite the counts of an exited one.
+    """
+    global _shared_path
+    if _shared_path is not None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _shared_path = os.path.join(directory, f"metrics-{os.getpid()}-{time.time_ns()}.json")
+    _write_shared()
+
+    def write_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                _write_shared()
+            except OSError as e:
+                print(f"Error writing metrics to {_shared_path}: {e}")
+
+    threading.Thread(target=write_loop, name="metrics-writer", daemon=True).start()
+
+def clear_shared_metrics(directory):
+    """Delete the metrics files in directory, those of an earlier run before the workers start."""
+    for path in glob.glob(os.path.join(directory, "metrics-*.json*")):
+        os.unlink(path)
+
+def render():
+    """All metrics in the Prometheus text exposition format, summed over the processes sharing them."""
+    if _shared_path is None:
+        processes = [_collect()]
+    else:
+        _write_shared()
+        processes = []
+        for path in glob.glob(os.path.join(os.path.dirname(_shared_path), "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    processes.append(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Error reading metrics from {path}: {e}")
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render([process.get(metric.name, []) for process in processes]))
+    return "\n".join(lines) + "\n"
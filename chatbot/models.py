@@ -1,30 +1,52 @@
+"""Read-only loading of the models trained offline by chatbot.train.
+
+Serving never fits anything. The manifest of the published models is read
+when a snapshot is built, which fails fast if they were trained on other
+data than the artifact bundle, and the classifier is only unpickled on
+first use.
+"""
+import json
 import os
 import pickle
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.model_selection import train_test_split
-from chatbot.data_processing import processed_questions, categories, vectorizer, tfidf_matrix
+import threading
+from chatbot.artifacts import current_bundle_dir
+from chatbot.config import TRAINED_MODELS_DIR
+
+# Bump whenever the set of models or their inputs change
+MODEL_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
 
-# Split data
-X_train, X_test, y_train, y_test = train_test_split(processed_questions, categories, test_size=0.2, random_state=42)
-X_train_tfidf = vectorizer.transform(X_train)
-X_test_tfidf = vectorizer.transform(X_test)
+class StaleModelError(ValueError):
+    """The published models do not match the artifact bundle being served."""
 
-# Train Naive Bayes classifier
-nb_classifier = MultinomialNB(alpha=0.1)
-nb_classifier.fit(X_train_tfidf, y_train)
+class TrainedModels:
+    def __init__(self, model_dir):
+        self.path = model_dir
+        with open(os.path.join(model_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['version']
+        self.data_hash = self.manifest['data_hash']
+        self._nb_classifier = None
+        self._lock = threading.Lock()
 
-# Train KNN classifier
-X_train_dense = X_train_tfidf.toarray()
-knn_classifier = KNeighborsClassifier(n_neighbors=5, metric='cosine')
-knn_classifier.fit(X_train_dense, y_train)
+    @property
+    def nb_classifier(self):
+        if self._nb_classifier is None:
+            with self._lock:
+                if self._nb_classifier is None:
+                    with open(os.path.join(self.path, 'nb_classifier.pkl'), 'rb') as f:
+                        self._nb_classifier = pickle.load(f)
+        return self._nb_classifier
 
-# Save models
-if not os.path.exists("models"):
-    os.makedirs("models")
-with open('models/nb_classifier.pkl', 'wb') as f:
-    pickle.dump(nb_classifier, f)
-with open('models/knn_classifier.pkl', 'wb') as f:
-    pickle.dump(knn_classifier, f)
-with open('models/vectorizer.pkl', 'wb') as f:
-    pickle.dump(vectorizer, f)
\ No newline at end of file
+def load_models(bundle, models_root=TRAINED_MODELS_DIR):
+    """Return the published models, raising StaleModelError unless they were trained on bundle."""
+    model_dir = current_bundle_dir(models_root)
+    if model_dir is None:
+        raise StaleModelError(f"No trained models in {models_root}, run python -m chatbot.train")
+    models = TrainedModels(model_dir)
+    if models.manifest.get('format') != MODEL_FORMAT:
+        raise StaleModelError(f"Unsupported model format in {model_dir}: {models.manifest.get('format')}")
+    if models.data_hash != bundle.data_hash or models.manifest['n_features'] != bundle.tfidf_matrix.shape[1]:
+        raise StaleModelError(f"Models {models.version} were trained on other data than artifacts "
+                              f"{bundle.version}, run python -m chatbot.train")
+    return models
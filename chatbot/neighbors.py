@@ -0,0 +1,71 @@
+"""Nearest-neighbour search directly on the L2-normalized TF-IDF rows.
+
+The rows are unit vectors, so a sparse product with the query gives the
+cosine similarity without densifying anything. row_to_entry maps each
+neighbour back to the entry it belongs to.
+
+Rows added while serving go to a small delta matrix searched alongside the
+base one, and are merged into it by compact().
+"""
+import threading
+import numpy as np
+import scipy.sparse as sp
+
+class SparseNeighbors:
+    """Top-k cosine neighbours over a CSR matrix."""
+
+    def __init__(self, matrix, row_to_entry):
+        # Read once per search, so a concurrent append or compaction is seen whole
+        self._segments = (matrix, None)
+        self._write_lock = threading.Lock()
+        self.row_to_entry = row_to_entry
+
+    @property
+    def matrix(self):
+        return self._segments[0]
+
+    @property
+    def n_delta(self):
+        delta = self._segments[1]
+        return 0 if delta is None else delta.shape[0]
+
+    def similarities(self, X):
+        """Sparse cosine similarities of the query rows X against every stored row."""
+        matrix, delta = self._segments
+        similarities = X @ matrix.T
+        if delta is not None:
+            similarities = sp.hstack([similarities, X @ delta.T])
+        return similarities.tocsr()
+
+    def append(self, rows, row_to_entry):
+        """Add normalized rows after the existing ones; row_to_entry must already cover them."""
+        with self._write_lock:
+            matrix, delta = self._segments
+            delta = rows.tocsr() if delta is None else sp.vstack([delta, rows], format='csr')
+            self.row_to_entry = row_to_entry
+            self._segments = (matrix, delta)
+
+    def compact(self):
+        """Merge the delta rows into the base matrix, off the search path."""
+        matrix, delta = self._segments
+        if delta is None:
+            return
+        merged = sp.vstack([matrix, delta], format='csr')
+        with self._write_lock:
+            # Rows appended during the merge stay in the delta
+            current_delta = self._segments[1]
+            rest = current_delta[delta.shape[0]:] if current_delta.shape[0] > delta.shape[0] else None
+            self._segments = (merged, rest)
+
+    def kneighbors_from_similarities(self, similarities, k=5):
+        """Per query a list of (row, similarity) pairs, best first, from similarities() already computed."""
+        neighbours = []
+        for i in range(similarities.shape[0]):
+            start, end = similarities.indptr[i], similarities.indptr[i + 1]
+            rows, sims = similarities.indices[start:end], similarities.data[start:end]
+            if len(sims) > k:
+                top = np.argpartition(-sims, k - 1)[:k]
+                rows, sims = rows[top], sims[top]
+            order = np.argsort(-sims, kind='stable')
+            neighbours.append(list(zip(rows[order].tolist(), sims[order].tolist())))
+        return neighbours
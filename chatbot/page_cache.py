@@ -0,0 +1,47 @@
+"""Rendered pages kept in memory until the data they show changes.
+
+A page is cached under a key together with the version of its data, and is
+only served for that version, so a stale page is never returned even if an
+invalidation was missed, e.g. by another process. invalidate() drops the
+pages of a group, such as the shared pages of a deleted session, right away.
+"""
+import threading
+from collections import OrderedDict
+
+class PageCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        """The page cached under key for this version, or None."""
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached is None or cached[0] != version:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return cached[2]
+
+    def put(self, key, version, body, group=None):
+        with self._lock:
+            self._pages[key] = (version, group, body)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def invalidate(self, group):
+        """Drop the pages of a group; return how many were dropped."""
+        with self._lock:
+            keys = [key for key, (_, page_group, _) in self._pages.items() if page_group == group]
+            for key in keys:
+                del self._pages[key]
+        return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._pages), "hits": self.hits, "misses": self.misses}
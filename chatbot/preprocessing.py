@@ -0,0 +1,81 @@
+import string
+from functools import lru_cache
+import nltk
+import numpy as np
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer
+from langdetect import detect, DetectorFactory
+
+nltk.download('punkt', quiet=True)
+nltk.download('stopwords', quiet=True)
+
+# Make langdetect deterministic for the queries that still reach it
+DetectorFactory.seed = 0
+
+FRENCH_ACCENTS = frozenset('àâæçéèêëîïôœùûüÿ')
+
+class TextPreprocessor:
+    """Lowercase, strip punctuation, drop stop words and stem.
+
+    Stemmers, stop word sets and the translation table are built once, stems
+    and whole results are kept in bounded LRU caches. The language is guessed
+    from stop words and accents; langdetect is only used for longer texts
+    where that guess is a tie.
+    """
+
+    def __init__(self, token_cache_size=50000, query_cache_size=10000, min_detect_words=6):
+        self.stop_words = {
+            'fr': frozenset(stopwords.words('french')),
+            'en': frozenset(stopwords.words('english'))
+        }
+        self.stem = {
+            'fr': lru_cache(maxsize=token_cache_size)(SnowballStemmer('french').stem),
+            'en': lru_cache(maxsize=token_cache_size)(SnowballStemmer('english').stem)
+        }
+        self.punctuation_table = str.maketrans('', '', string.punctuation)
+        self.min_detect_words = min_detect_words
+        self._cached_process = lru_cache(maxsize=query_cache_size)(self.process)
+
+    def __call__(self, text):
+        return self._cached_process(text)
+
+    def detect_language(self, text, words):
+        """Return 'fr' or 'en' for already lowercased words of text."""
+        fr_score = sum(1 for word in words if word in self.stop_words['fr'])
+        en_score = sum(1 for word in words if word in self.stop_words['en'])
+        if any(char in FRENCH_ACCENTS for char in text):
+            fr_score += 1
+        if fr_score != en_score or len(words) < self.min_detect_words:
+            return 'en' if en_score > fr_score else 'fr'
+        try:
+            return 'fr' if detect(text) == 'fr' else 'en'
+        except Exception:
+            return 'fr'
+
+    def process(self, text):
+        """Preprocess text without going through the result cache."""
+        text = text.lower().translate(self.punctuation_table)
+        words = word_tokenize(text)
+        lang = self.detect_language(text, words)
+        stop_words = self.stop_words[lang]
+        stem = self.stem[lang]
+        return ' '.join([stem(word) for word in words if word not in stop_words])
+
+    def cache_info(self):
+        return {
+            'queries': self._cached_process.cache_info(),
+            'stems_fr': self.stem['fr'].cache_info(),
+            'stems_en': self.stem['en'].cache_info()
+        }
+
+default_preprocessor = TextPreprocessor()
+
+def preprocess_text(text):
+    """Preprocess text for analysis."""
+    return default_preprocessor(text)
+
+def tokens_vector_fasttext(words, model):
+    """Average the FastText vectors of already preprocessed tokens."""
+    word_vectors = [model.wv[word] for word in words if word in model.wv]
+    return np.mean(word_vectors, axis=0) if word_vectors else np.zeros(model.vector_size)
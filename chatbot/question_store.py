@@ -0,0 +1,97 @@
+"""Questions answered by the external API, saved per user in SQLite.
+
+Replaces the append-only data/new_questions.json log: lookups, inserts and
+removals go through the (user_id, normalized_question) index instead of a
+scan of the whole file. The JSONL log is imported once, on first use.
+"""
+import json
+import os
+import pandas as pd
+from chatbot.sqlite_store import SQLiteStore
+
+def normalize_question(question):
+    return question.strip().lower()
+
+class QuestionStore(SQLiteStore):
+    def __init__(self, path):
+        super().__init__(path, '''
+            CREATE TABLE IF NOT EXISTS new_questions (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                normalized_question TEXT NOT NULL,
+                question TEXT NOT NULL,
+                response TEXT,
+                rating INTEGER,
+                timestamp TEXT
+            );
+            CREATE INDEX IF NOT EXISTS ix_new_questions_user_question
+                ON new_questions (user_id, normalized_question);
+            CREATE TABLE IF NOT EXISTS new_questions_meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+
+    def find(self, user_id, question):
+        """Saved response of user_id to question, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response FROM new_questions WHERE user_id IS ? AND normalized_question = ? LIMIT 1',
+                (user_id, normalize_question(question))).fetchone()
+        return row[0] if row else None
+
+    def save(self, user_id, question, response, rating=None, timestamp=None):
+        """Save a question unless user_id already saved it; return True if inserted."""
+        normalized = normalize_question(question)
+        with self._lock, self._conn:
+            if self._exists(user_id, normalized):
+                return False
+            self._insert(user_id, normalized, question, response, rating, timestamp)
+        return True
+
+    def remove(self, user_id, question):
+        """Delete the saved copies of question for user_id; return how many were deleted."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM new_questions WHERE user_id IS ? AND normalized_question = ?',
+                (user_id, normalize_question(question)))
+        return cursor.rowcount
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM new_questions').fetchone()[0]
+
+    def migrate_jsonl(self, jsonl_path):
+        """Import a new_questions.json log once; return the number of rows imported."""
+        marker = f"migrated:{os.path.abspath(jsonl_path)}"
+        with self._lock, self._conn:
+            if self._conn.execute('SELECT 1 FROM new_questions_meta WHERE key = ?', (marker,)).fetchone():
+                return 0
+            imported = 0
+            if os.path.exists(jsonl_path):
+                with open(jsonl_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        user_id = entry.get('user_id')
+                        normalized = normalize_question(entry['question'])
+                        if self._exists(user_id, normalized):
+                            continue
+                        self._insert(user_id, normalized, entry['question'], entry.get('response'),
+                                     entry.get('rating'), entry.get('timestamp'))
+                        imported += 1
+            self._conn.execute('INSERT INTO new_questions_meta (key, value) VALUES (?, ?)',
+                               (marker, pd.Timestamp.now().isoformat()))
+        return imported
+
+    def _exists(self, user_id, normalized):
+        return self._conn.execute(
+            'SELECT 1 FROM new_questions WHERE user_id IS ? AND normalized_question = ? LIMIT 1',
+            (user_id, normalized)).fetchone() is not None
+
+    def _insert(self, user_id, normalized, question, response, rating, timestamp):
+        self._conn.execute(
+            'INSERT INTO new_questions (user_id, normalized_question, question, response, rating, timestamp) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (user_id, normalized, question, response, rating, timestamp or pd.Timestamp.now().isoformat()))
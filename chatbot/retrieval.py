@@ -0,0 +1,112 @@
+"""Hybrid retrieval fusing sparse TF-IDF, dense FastText and KNN signals.
+
+A query is preprocessed once and encoded once into its TF-IDF row and its
+FastText vector. Row scores are max-pooled per entry, so variations of one
+entry never crowd other entries out of the top k, and the per-entry lists
+are fused into a single ranked list:
+
+- "weighted": weighted mean of the per-signal scores
+- "rrf": weighted reciprocal-rank fusion, normalized so the best possible
+  candidate scores 1.0
+
+Whatever the fusion rule, every candidate also carries `similarity`, the
+weighted mean of its raw scores, which is what the caller thresholds on.
+"""
+import numpy as np
+from chatbot.metrics import timed
+from chatbot.preprocessing import tokens_vector_fasttext
+
+SIGNALS = ("tfidf", "fasttext", "knn")
+
+class HybridRetriever:
+    def __init__(self, vectorizer, sparse_index, dense_index, fasttext_model, knowledge_base, config):
+        self.vectorizer = vectorizer
+        self.sparse_index = sparse_index
+        self.dense_index = dense_index
+        self.fasttext_model = fasttext_model
+        self.knowledge_base = knowledge_base
+        self.k = config["k"]
+        self.dense_oversample = config["dense_oversample"]
+        self.fusion = config["fusion"]
+        self.weights = {name: float(config["weights"].get(name, 0.0)) for name in SIGNALS}
+        self.rrf_k = config["rrf_k"]
+        if self.fusion not in ("weighted", "rrf"):
+            raise ValueError(f"Unknown fusion rule: {self.fusion}")
+
+    def encode(self, processed_queries, timings=None):
+        """Sparse TF-IDF rows and FastText vectors of already preprocessed queries."""
+        with timed("tfidf_encode", timings):
+            X = self.vectorizer.transform(processed_queries)
+        with timed("fasttext_encode", timings):
+            V = np.array([tokens_vector_fasttext(q.split(), self.fasttext_model) for q in processed_queries],
+                         dtype=np.float32).reshape(len(processed_queries), self.fasttext_model.vector_size)
+        return X, V
+
+    def retrieve(self, processed_queries):
+        """Ranked candidates of every query, see retrieve_encoded."""
+        return self.retrieve_encoded(*self.encode(processed_queries))
+
+    def retrieve_encoded(self, X, V, timings=None):
+        """Return per query a list of candidates, best first.
+
+        A candidate is a dict with `entry_id`, the fused `score`, the
+        thresholdable `similarity` and the per-signal scores in `signals`.
+        Each step is timed, see chatbot.metrics.timed.
+        """
+        with timed("tfidf", timings):
+            similarities = self.sparse_index.similarities(X)
+        with timed("knn", timings):
+            neighbours = self.sparse_index.kneighbors_from_similarities(similarities, k=self.k)
+        with timed("fasttext", timings):
+            # Dense search only sees its top rows, ask for more so pooling still yields k entries
+            dense_rows, dense_scores = self.dense_index.search(V, k=self.k * self.dense_oversample)
+        ranked = []
+        with timed("fusion", timings):
+            for i, pairs in enumerate(neighbours):
+                start, end = similarities.indptr[i], similarities.indptr[i + 1]
+                pooled = {
+                    "tfidf": self._max_pool(similarities.indices[start:end], similarities.data[start:end]),
+                    "fasttext": self._max_pool(dense_rows[i], dense_scores[i]),
+                    "knn": self._vote_share(pairs)
+                }
+                ranked.append(self._fuse(pooled))
+        return ranked
+
+    def _max_pool(self, rows, scores):
+        """Top k entries by their best row score, as an ordered list of pairs."""
+        entry_ids, pooled = self.knowledge_base.pool_max(rows, scores, k=self.k)
+        return list(zip(entry_ids.tolist(), pooled.tolist()))
+
+    def _vote_share(self, pairs):
+        """Share of the neighbours' summed similarity going to each entry."""
+        votes = {}
+        row_to_entry, deleted = self.knowledge_base.row_to_entry, self.knowledge_base.deleted
+        for row, score in pairs:
+            entry_id = int(row_to_entry[row])
+            if entry_id in deleted:
+                continue
+            votes[entry_id] = votes.get(entry_id, 0.0) + score
+        total = sum(votes.values())
+        if total <= 0:
+            return []
+        return sorted(((e, v / total) for e, v in votes.items()), key=lambda item: item[1], reverse=True)
+
+    def _fuse(self, pooled):
+        total_weight = sum(self.weights.values()) or 1.0
+        best_rrf = sum(w / (self.rrf_k + 1) for w in self.weights.values()) or 1.0
+        candidates = {}
+        for name, ordered in pooled.items():
+            for rank, (entry_id, score) in enumerate(ordered, start=1):
+                candidate = candidates.setdefault(entry_id, {
+                    "entry_id": entry_id,
+                    "signals": dict.fromkeys(SIGNALS, 0.0),
+                    "rrf": 0.0
+                })
+                candidate["signals"][name] = float(score)
+                candidate["rrf"] += self.weights[name] / (self.rrf_k + rank)
+        for candidate in candidates.values():
+            signals = candidate["signals"]
+            candidate["similarity"] = sum(self.weights[n] * signals[n] for n in SIGNALS) / total_weight
+            rrf = candidate.pop("rrf") / best_rrf
+            candidate["score"] = candidate["similarity"] if self.fusion == "weighted" else rrf
+        return sorted(candidates.values(), key=lambda c: c["score"], reverse=True)[:self.k]
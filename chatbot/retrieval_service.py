@@ -0,0 +1,273 @@
+"""Hybrid retrieval served by a pool of processes, away from the web workers' GIL.
+
+    RETRIEVAL_SERVICE_ADDRESS=/tmp/isbot-retrieval.sock python -m chatbot.retrieval_service
+
+The service loads the published knowledge snapshot once, then forks its
+workers, which share the memory-mapped artifacts and the models loaded
+before the fork. Each batch is sent over its own connection to a Unix
+socket every worker accepts on, so the next idle worker takes it.
+
+Web processes started with the same RETRIEVAL_SERVICE_ADDRESS rank their
+queries through a RetrievalClient. Its threads merge whatever queries are
+waiting when they become free into one batch, so concurrent requests share
+a round trip without waiting for each other. A batch carries the snapshot
+version it was asked for; a worker serving another version reloads the
+published bundle, and if the versions still differ, the service cannot be
+reached or it does not answer before the request's deadline, the client
+raises RetrievalUnavailable and the caller ranks locally.
+
+Workers replay the shared update log of rated answers like the web
+processes do. A batch carries the last log row its web process applied
+and the worker reads the log up to it first; the client still drops
+matches of entries deleted in between.
+"""
+import os
+import queue
+import signal
+import socket
+import struct
+import threading
+from concurrent.futures import Future, InvalidStateError, TimeoutError
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener, wait
+import numpy as np
+from chatbot.artifacts import StaleArtifactsError, load_published
+from chatbot.config import ARTIFACTS_DIR, DATA_PATH, KB_UPDATES_DB_PATH, LIVE_UPDATES, RETRIEVAL_SERVICE
+from chatbot.live_updates import LiveIndex
+from chatbot.metrics import timed, STAGE_SECONDS
+from chatbot.preprocessing import preprocess_text
+from chatbot.models import StaleModelError
+from chatbot.snapshot import SnapshotManager, KnowledgeSnapshot
+from chatbot.update_log import UpdateLog
+
+class RetrievalUnavailable(Exception):
+    pass
+
+def rank(snapshot, queries, timings=None):
+    """Best candidate or None, predicted category and FastText vector of each query.
+
+    This is the CPU-bound part of the cascade, run in the web process or in
+    a service worker.
+    """
+    with timed("preprocess", timings):
+        processed = [preprocess_text(query) for query in queries]
+    retriever = snapshot.retriever
+    X, V = retriever.encode(processed, timings)
+    with timed("classify", timings):
+        categories = snapshot.nb_classifier.predict(X).tolist()
+    ranked = retriever.retrieve_encoded(X, V, timings)
+    return [candidates[0] if candidates else None for candidates in ranked], categories, V
+
+class RetrievalClient:
+    def __init__(self, address, connections=4, max_batch=64, timeout=5.0):
+        self.address = address
+        self.connections = connections
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.available = True
+        # Batches sent and the queries they held, to see how much requests are merged
+        self.batches = 0
+        self.batched_queries = 0
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def start(self):
+        """Start the threads sending batches, once per process."""
+        if not self._threads:
+            for i in range(self.connections):
+                thread = threading.Thread(target=self._dispatch_loop, name=f"retrieval-client-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def rank(self, version, queries, timings=None, timeout=None, updates=0):
+        """Like rank() on the snapshot of this version. Raises RetrievalUnavailable.
+
+        Waits at most timeout seconds, e.g. what is left of the request's
+        deadline, and never longer than the client's timeout. The service
+        first applies the update log up to row updates at least.
+        """
+        if not self._threads:
+            raise RetrievalUnavailable("retrieval client not started")
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        future = Future()
+        self._queue.put((version, queries, future, updates))
+        try:
+            best, categories, vectors, remote_timings = future.result(timeout)
+        except TimeoutError:
+            # Not sent if still queued, otherwise its late result is ignored
+            future.cancel()
+            raise RetrievalUnavailable(f"no answer within {timeout:.3f}s")
+        if timings is not None:
+            for stage, ms in remote_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + ms
+        return best, categories, vectors
+
+    def _dispatch_loop(self):
+        while True:
+            item = self._queue.get()
+            # Requests that gave up waiting are cancelled, the others can no longer be
+            if not item[2].set_running_or_notify_cancel():
+                continue
+            batch = [item]
+            size = len(item[1])
+            # Only what is already waiting, a lone request is sent at once
+            while size < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item[0] != batch[0][0]:
+                    # Asked for another snapshot version, around a swap
+                    self._queue.put(item)
+                    break
+                if not item[2].set_running_or_notify_cancel():
+                    continue
+                batch.append(item)
+                size += len(item[1])
+            self._send(batch)
+
+    def _send(self, batch):
+        version = batch[0][0]
+        queries = [query for _, item_queries, _, _ in batch for query in item_queries]
+        updates = max(item[3] for item in batch)
+        try:
+            with Client(self.address, family='AF_UNIX') as conn:
+                _set_send_timeout(conn, self.timeout)
+                conn.send((version, updates, queries))
+                if not conn.poll(self.timeout):
+                    raise RetrievalUnavailable(f"no answer within {self.timeout}s")
+                reply = conn.recv()
+            if reply[0] != "ok":
+                raise RetrievalUnavailable(f"retrieval service: {reply[0]} {reply[1]}")
+        except Exception as e:
+            # Every waiting request must be released, whatever went wrong
+            if self.available:
+                print(f"Retrieval service unavailable, ranking locally: {e}")
+            self.available = False
+            error = e if isinstance(e, RetrievalUnavailable) else RetrievalUnavailable(str(e))
+            for _, _, future, _ in batch:
+                _settle(future, exception=error)
+            return
+        if not self.available:
+            print("Retrieval service available again")
+        self.available = True
+        self.batches += 1
+        self.batched_queries += len(queries)
+        _, best, categories, vectors, timings = reply
+        for stage, ms in timings.items():
+            STAGE_SECONDS.observe(ms / 1000, stage=stage)
+        start = 0
+        for _, item_queries, future, _ in batch:
+            end = start + len(item_queries)
+            _settle(future, (best[start:end], categories[start:end], vectors[start:end], timings))
+            start = end
+
+def _settle(future, result=None, exception=None):
+    # Whoever waited on it may have given up already
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+def _set_send_timeout(conn, seconds):
+    """Make writes to conn fail after seconds, like poll(seconds) bounds the wait for its answer."""
+    with socket.socket(fileno=os.dup(conn.fileno())) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                        struct.pack('ll', int(seconds), int(seconds % 1 * 1_000_000)))
+
+def _serve(listener, snapshots, live_index):
+    while True:
+        try:
+            conn = listener.accept()
+        except OSError:
+            continue
+        with conn:
+            try:
+                version, updates, queries = conn.recv()
+                snapshot = snapshots.current
+                if version != snapshot.version and snapshots.reload(ARTIFACTS_DIR):
+                    snapshot = snapshots.current
+                if version != snapshot.version:
+                    conn.send(("stale", snapshot.version))
+                    continue
+                if updates > live_index.version:
+                    live_index.catch_up()
+                timings = {}
+                best, categories, vectors = rank(snapshot, queries, timings)
+                conn.send(("ok", best, categories, np.ascontiguousarray(vectors), timings))
+            except (OSError, EOFError):
+                pass
+            except Exception as e:
+                print(f"Error in retrieval worker: {e}")
+                try:
+                    conn.send(("error", str(e)))
+                except OSError:
+                    pass
+
+def _worker(listener, snapshots, live_index):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    live_index.log.reopen()
+    live_index.start_compaction()
+    _serve(listener, snapshots, live_index)
+
+def serve(address, workers):
+    """Load the snapshot, fork the workers and keep them running until SIGTERM."""
+    try:
+        snapshot = KnowledgeSnapshot(load_published(ARTIFACTS_DIR, DATA_PATH))
+    except StaleArtifactsError as e:
+        raise SystemExit(f"{e}. Run python -m chatbot.train --build to build the artifacts and train the models.")
+    except StaleModelError as e:
+        raise SystemExit(str(e))
+    # Unpickled before forking so the workers share it
+    snapshot.nb_classifier
+    # The full-text index is the web processes' own, only the retrieval indexes get the ratings here
+    live_index = LiveIndex(UpdateLog(KB_UPDATES_DB_PATH), **LIVE_UPDATES)
+
+    def prepare(snapshot):
+        snapshot.updates_applied = live_index.replay(snapshot.retriever, snapshot.bundle.updates_through)
+
+    prepare(snapshot)
+    live_index.attach(snapshot.retriever, snapshot.updates_applied)
+    snapshots = SnapshotManager(snapshot, prepare=prepare,
+                                on_swap=lambda snapshot: live_index.attach(snapshot.retriever, snapshot.updates_applied))
+
+    if os.path.exists(address):
+        os.unlink(address)
+    old_umask = os.umask(0o077)
+    try:
+        listener = Listener(address, family='AF_UNIX', backlog=128)
+    finally:
+        os.umask(old_umask)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    context = get_context('fork')
+    processes = []
+    try:
+        print(f"Retrieval service for snapshot {snapshot.version} on {address}, {workers} workers")
+        while True:
+            for process in processes:
+                if not process.is_alive():
+                    print(f"Retrieval worker {process.pid} exited with code {process.exitcode}, restarting it")
+            processes = [p for p in processes if p.is_alive()]
+            while len(processes) < workers:
+                process = context.Process(target=_worker, args=(listener, snapshots, live_index),
+                                          name="retrieval-worker", daemon=True)
+                process.start()
+                processes.append(process)
+            wait([p.sentinel for p in processes])
+    finally:
+        for process in processes:
+            process.terminate()
+        listener.close()
+
+if __name__ == '__main__':
+    if not RETRIEVAL_SERVICE["address"]:
+        raise SystemExit("Set RETRIEVAL_SERVICE_ADDRESS to the socket path to listen on.")
+    serve(RETRIEVAL_SERVICE["address"], RETRIEVAL_SERVICE["workers"])
@@ -0,0 +1,152 @@
+"""Whoosh full-text index kept in sync with the knowledge base incrementally."""
+import hashlib
+import os
+import threading
+from whoosh import index
+from whoosh.fields import Schema, TEXT, ID
+from whoosh.filedb.filestore import FileStorage
+from chatbot.config import INDEX_DIR
+
+# Whoosh schema, `id` is the stable key used by update_document
+schema = Schema(
+    id=ID(stored=True, unique=True),
+    digest=ID(stored=True),
+    question=TEXT(stored=True),
+    answer=TEXT(stored=True),
+    url=TEXT(stored=True)
+)
+
+SYNC_MARKER = "kb_version"
+WRITER_TIMEOUT = 30.0
+
+def entry_key(entry):
+    """Stable identifier of an entry, derived from its question like the rest of the app."""
+    return hashlib.sha1(entry.question.strip().lower().encode('utf-8')).hexdigest()[:16]
+
+def entry_digest(entry):
+    """Fingerprint of the indexed content of an entry."""
+    content = '\0'.join([entry.question, entry.answer, entry.url])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def _read_marker(index_dir):
+    try:
+        with open(os.path.join(index_dir, SYNC_MARKER), 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def _write_marker(index_dir, version):
+    marker = os.path.join(index_dir, SYNC_MARKER)
+    tmp_marker = f"{marker}.{os.getpid()}.tmp"
+    with open(tmp_marker, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_marker, marker)
+
+def open_index(index_dir=INDEX_DIR):
+    """Open the index, creating it only if missing or built with an older schema."""
+    os.makedirs(index_dir, exist_ok=True)
+    # Serialize creation so concurrently starting workers do not both create_in
+    lock = FileStorage(index_dir).lock("CREATE")
+    lock.acquire(blocking=True)
+    try:
+        if index.exists_in(index_dir):
+            ix = index.open_dir(index_dir)
+            if set(ix.schema.names()) == set(schema.names()):
+                return ix
+            ix.close()
+        ix = index.create_in(index_dir, schema)
+        marker = os.path.join(index_dir, SYNC_MARKER)
+        if os.path.exists(marker):
+            os.remove(marker)
+        return ix
+    finally:
+        lock.release()
+
+def sync_index(ix, entries, version):
+    """Bring the index in line with the Entry objects; return True if anything changed.
+
+    The version of the last synced knowledge base is kept next to the index,
+    so an unchanged knowledge base costs a single file read.
+    """
+    index_dir = ix.storage.folder
+    if _read_marker(index_dir) == version:
+        return False
+
+    writer = ix.writer(timeout=WRITER_TIMEOUT)
+    try:
+        # Another process may have synced while we waited for the lock
+        if _read_marker(index_dir) == version:
+            writer.cancel()
+            return False
+        with writer.searcher() as searcher:
+            indexed = {fields['id']: fields['digest'] for fields in searcher.all_stored_fields()}
+
+        wanted = {}
+        for entry in entries:
+            wanted[entry_key(entry)] = entry
+        changed = 0
+        for key in indexed.keys() - wanted.keys():
+            writer.delete_by_term('id', key)
+            changed += 1
+        for key, entry in wanted.items():
+            digest = entry_digest(entry)
+            if indexed.get(key) != digest:
+                writer.update_document(
+                    id=key,
+                    digest=digest,
+                    question=entry.question,
+                    answer=entry.answer,
+                    url=entry.url
+                )
+                changed += 1
+        if changed:
+            # Merging is left to merge_segments_async to keep startup fast
+            writer.commit(merge=False)
+        else:
+            writer.cancel()
+    except Exception:
+        writer.cancel()
+        raise
+    _write_marker(index_dir, version)
+    return changed > 0
+
+def update_entry(ix, entry):
+    """Add or replace the document of a single entry."""
+    writer = ix.writer(timeout=WRITER_TIMEOUT)
+    try:
+        writer.update_document(
+            id=entry_key(entry),
+            digest=entry_digest(entry),
+            question=entry.question,
+            answer=entry.answer,
+            url=entry.url
+        )
+    except Exception:
+        writer.cancel()
+        raise
+    writer.commit(merge=False)
+
+def delete_entry(ix, entry):
+    """Remove the document of a single entry."""
+    writer = ix.writer(timeout=WRITER_TIMEOUT)
+    try:
+        writer.delete_by_term('id', entry_key(entry))
+    except Exception:
+        writer.cancel()
+        raise
+    writer.commit(merge=False)
+
+def merge_segments(ix):
+    """Merge the small segments left by incremental commits."""
+    try:
+        writer = ix.writer(timeout=WRITER_TIMEOUT)
+    except index.LockError:
+        # Someone else holds the writer and will merge on commit
+        return
+    writer.commit(merge=True)
+
+def merge_segments_async(ix):
+    """Merge small segments on a background thread."""
+    thread = threading.Thread(target=merge_segments, args=(ix,), name="whoosh-merge", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,139 @@
+"""Retrieval state of one artifact bundle, swapped atomically while serving.
+
+A KnowledgeSnapshot holds everything retrieval reads: the vectorizer, the
+knowledge base, the classifier and the search indexes of a single bundle.
+Requests read the current snapshot once, through SnapshotManager.use, and
+keep using it until they are done, so a response never mixes two versions.
+
+SnapshotManager.reload builds the snapshot of a newly published bundle off
+the request path, swaps it in, and lets the old one go once the requests
+still holding it have released it. It is triggered by the admin endpoint or
+by watch(), which polls the CURRENT pointer of the artifact directory.
+Live updates only ever target the current snapshot.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from chatbot.artifacts import ArtifactBundle, current_bundle_dir
+from chatbot.config import ARTIFACTS_DIR, TRAINED_MODELS_DIR, RETRIEVAL
+from chatbot.embeddings_utils import build_fasttext_index
+from chatbot.models import load_models
+from chatbot.neighbors import SparseNeighbors
+from chatbot.retrieval import HybridRetriever
+
+class KnowledgeSnapshot:
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.version = bundle.version
+        self.data_hash = bundle.data_hash
+        self.vectorizer = bundle.vectorizer
+        self.knowledge_base = bundle.knowledge_base
+        self.fasttext_model = bundle.fasttext_model
+        # Fails fast on models trained for other data, unpickled on first use
+        self.models = load_models(bundle)
+        # Nearest neighbours over every row of the normalized TF-IDF matrix
+        self.knn_index = SparseNeighbors(bundle.tfidf_matrix, bundle.row_to_entry)
+        self.fasttext_index = build_fasttext_index(bundle.fasttext_question_vectors)
+        self.retriever = HybridRetriever(self.vectorizer, self.knn_index, self.fasttext_index,
+                                         self.fasttext_model, self.knowledge_base, RETRIEVAL)
+        self._refs = 0
+        self._released = threading.Condition()
+
+    @property
+    def nb_classifier(self):
+        return self.models.nb_classifier
+
+    def acquire(self):
+        with self._released:
+            self._refs += 1
+
+    def release(self):
+        with self._released:
+            self._refs -= 1
+            if not self._refs:
+                self._released.notify_all()
+
+    def wait_drained(self, timeout=None):
+        """Wait until no request holds the snapshot; return False on timeout."""
+        with self._released:
+            return self._released.wait_for(lambda: self._refs == 0, timeout)
+
+class SnapshotManager:
+    def __init__(self, snapshot, prepare=None, on_swap=None, drain_timeout=300):
+        self._current = snapshot
+        # Held while reading and referencing the current snapshot, and while swapping it
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # prepare(snapshot) runs before a snapshot is published, on_swap(snapshot) right after
+        self.prepare = prepare
+        self.on_swap = on_swap
+        self.drain_timeout = drain_timeout
+        self._watcher = None
+        # Bundle and models that last failed to load, not tried again until one of them changes
+        self._failed = None
+
+    @property
+    def current(self):
+        return self._current
+
+    @contextmanager
+    def use(self):
+        """Hold the current snapshot for the duration of the block."""
+        with self._lock:
+            snapshot = self._current
+            snapshot.acquire()
+        try:
+            yield snapshot
+        finally:
+            snapshot.release()
+
+    def reload(self, out_root=ARTIFACTS_DIR):
+        """Swap in the published bundle if it is not the current one; return True if swapped.
+
+        A bundle that failed to load, e.g. without matching trained models,
+        is skipped until it or the published models change.
+        """
+        with self._reload_lock:
+            bundle_dir = current_bundle_dir(out_root)
+            if bundle_dir is None or os.path.realpath(bundle_dir) == os.path.realpath(self._current.bundle.path):
+                return False
+            attempt = (os.path.realpath(bundle_dir), current_bundle_dir(TRAINED_MODELS_DIR))
+            if attempt == self._failed:
+                return False
+            try:
+                snapshot = KnowledgeSnapshot(ArtifactBundle(bundle_dir))
+                if self.prepare:
+                    self.prepare(snapshot)
+            except Exception:
+                self._failed = attempt
+                raise
+            with self._lock:
+                old, self._current = self._current, snapshot
+            if self.on_swap:
+                self.on_swap(snapshot)
+        print(f"Knowledge snapshot {old.version} replaced by {snapshot.version}")
+        threading.Thread(target=self._retire, args=(old,), name="snapshot-drain", daemon=True).start()
+        return True
+
+    def _retire(self, snapshot):
+        if not snapshot.wait_drained(self.drain_timeout):
+            print(f"Knowledge snapshot {snapshot.version} still in use after {self.drain_timeout}s")
+            return
+        print(f"Knowledge snapshot {snapshot.version} drained")
+
+    def _watch_loop(self, out_root, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload(out_root)
+            except Exception as e:
+                print(f"Error reloading the knowledge snapshot: {e}")
+
+    def watch(self, out_root=ARTIFACTS_DIR, interval=5):
+        """Reload whenever a new bundle is published under out_root."""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_loop, args=(out_root, interval),
+                                             name="snapshot-watch", daemon=True)
+            self._watcher.start()
+        return self._watcher
@@ -0,0 +1,30 @@
+"""Base of the stores keeping their own SQLite file next to the app database."""
+import os
+import sqlite3
+import threading
+
+def connect(path):
+    """Connection shared by the threads of a process, in WAL mode so processes read while one writes."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+class SQLiteStore:
+    """Opens path, creating its directory, and runs schema, a script of CREATE ... IF NOT EXISTS.
+
+    Subclasses use self._conn under self._lock.
+    """
+    def __init__(self, path, schema):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.executescript(schema)
+
+    def reopen(self):
+        """Open a new connection, e.g. in a forked worker, which must not use its parent's."""
+        self._lock = threading.Lock()
+        self._conn = connect(self.path)
@@ -0,0 +1,78 @@
+"""Offline training of the category classifier.
+
+Train on the published artifact bundle with:
+
+    python -m chatbot.train --artifacts models/kb --out models/trained
+
+Add --build to rebuild the artifacts from the data file first. Every run is
+written to its own version directory with a manifest naming the bundle and
+data hash it was fitted on, then the ``CURRENT`` file is switched to it, so
+serving processes only ever load a complete, matching set of models.
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.model_selection import train_test_split
+from chatbot.config import DATA_PATH, ARTIFACTS_DIR, TRAINED_MODELS_DIR, KB_UPDATES_DB_PATH
+from chatbot.artifacts import build_artifacts, load_artifacts, publish_current
+from chatbot.models import MODEL_FORMAT, MANIFEST_FILE
+
+def train_nb_classifier(tfidf_matrix, knowledge_base):
+    """Fit the category classifier; return it with its accuracy on the held-out rows."""
+    # The rows of tfidf_matrix already are the transformed questions
+    X_train_tfidf, X_test_tfidf, y_train, y_test = train_test_split(
+        tfidf_matrix, knowledge_base.row_categories(), test_size=0.2, random_state=42)
+    nb_classifier = MultinomialNB(alpha=0.1)
+    nb_classifier.fit(X_train_tfidf, y_train)
+    return nb_classifier, float(nb_classifier.score(X_test_tfidf, y_test))
+
+def train_models(bundle, out_root=TRAINED_MODELS_DIR):
+    """Fit the models on bundle and publish them as a new version."""
+    nb_classifier, accuracy = train_nb_classifier(bundle.tfidf_matrix, bundle.knowledge_base)
+
+    os.makedirs(out_root, exist_ok=True)
+    model_dir = tempfile.mkdtemp(prefix='.train-', dir=out_root)
+    try:
+        with open(os.path.join(model_dir, 'nb_classifier.pkl'), 'wb') as f:
+            pickle.dump(nb_classifier, f)
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{bundle.data_hash[:12]}"
+        manifest = {
+            "format": MODEL_FORMAT,
+            "version": version,
+            "bundle_version": bundle.version,
+            "data_hash": bundle.data_hash,
+            "created_at": time.time(),
+            "n_features": bundle.tfidf_matrix.shape[1],
+            "classes": nb_classifier.classes_.tolist(),
+            "test_accuracy": accuracy
+        }
+        with open(os.path.join(model_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        final_dir = os.path.join(out_root, version)
+        os.replace(model_dir, final_dir)
+    except Exception:
+        shutil.rmtree(model_dir, ignore_errors=True)
+        raise
+    publish_current(out_root, version)
+    return final_dir
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the models served with the knowledge-base artifacts.")
+    parser.add_argument('--data', default=DATA_PATH, help="knowledge-base JSON file, used with --build")
+    parser.add_argument('--artifacts', default=ARTIFACTS_DIR, help="artifact root directory")
+    parser.add_argument('--out', default=TRAINED_MODELS_DIR, help="trained model root directory")
+    parser.add_argument('--build', action='store_true', help="rebuild the artifacts before training")
+    parser.add_argument('--updates', default=KB_UPDATES_DB_PATH,
+                        help="log of rated answers to fold into --data first with --build, empty to leave the data as is")
+    args = parser.parse_args()
+    if args.build:
+        print(f"Artifacts written to {build_artifacts(args.data, args.artifacts, args.updates)}")
+    bundle = load_artifacts(args.artifacts)
+    if bundle is None:
+        parser.error(f"No artifacts published in {args.artifacts}, run with --build")
+    print(f"Models written to {train_models(bundle, args.out)}")
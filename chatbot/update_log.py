@@ -0,0 +1,90 @@
+"""Shared log of the knowledge-base changes made by ratings, in SQLite.
+
+A rating appends an upsert or a delete here instead of rewriting data.json.
+Every serving process, the retrieval service's included, replays the rows
+newer than its artifact bundle on top of it, at start and after a snapshot
+swap, then reads the new ones as they come, so they all answer from the
+same knowledge base.
+
+The offline build folds the rows into data.json before building, see
+fold_into, and records in the bundle manifest the last row it folded.
+"""
+import datetime
+import json
+import os
+from chatbot.sqlite_store import SQLiteStore
+
+class UpdateLog(SQLiteStore):
+    def __init__(self, path):
+        super().__init__(path, '''
+            CREATE TABLE IF NOT EXISTS kb_updates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT,
+                user_id INTEGER,
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS kb_updates_meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+
+    def append(self, op, question, answer=None, user_id=None):
+        """Log an "upsert" of question with answer, or a "delete" of it; return the row id."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                'INSERT INTO kb_updates (op, question, answer, user_id, created_at) VALUES (?, ?, ?, ?, ?)',
+                (op, question, answer, user_id, datetime.datetime.now().isoformat())).lastrowid
+
+    def since(self, last_id):
+        """(id, op, question, answer) of the rows after last_id, oldest first."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT id, op, question, answer FROM kb_updates WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+
+    def fold_into(self, data_path):
+        """Apply the rows not folded yet to the data file; return the id of the last row folded, 0 if none.
+
+        Run by the offline build only, the data file is rewritten whole.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM kb_updates_meta WHERE key = 'folded_through'").fetchone()
+            folded = int(row[0]) if row else 0
+            rows = self._conn.execute(
+                'SELECT id, op, question, answer, user_id, created_at FROM kb_updates WHERE id > ? ORDER BY id',
+                (folded,)).fetchall()
+            if not rows:
+                return folded
+            with open(data_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for _, op, question, answer, user_id, created_at in rows:
+                data = _fold(data, op, question, answer, user_id, created_at)
+            tmp_path = f"{data_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, data_path)
+            folded = rows[-1][0]
+            self._conn.execute("INSERT OR REPLACE INTO kb_updates_meta (key, value) VALUES ('folded_through', ?)",
+                               (str(folded),))
+        return folded
+
+def _fold(data, op, question, answer, user_id, created_at):
+    key = question.strip().lower()
+    if op == 'delete':
+        return [entry for entry in data if entry['question'].strip().lower() != key]
+    for entry in data:
+        if entry['question'].strip().lower() == key:
+            entry['answer'] = answer
+            entry['user_id'] = user_id
+            entry['timestamp'] = created_at
+            return data
+    data.append({
+        "id": len(data) + 1,
+        "category": "user_rated",
+        "question": question.strip(),
+        "question_variations": [],
+        "answer": answer,
+        "url": "",
+        "user_id": user_id,
+        "timestamp": created_at
+    })
+    return data
@@ -0,0 +1,171 @@
+"""Cosine-similarity search over dense embeddings.
+
+ExactIndex scores every row with one matrix product. IVFIndex clusters the
+rows with spherical k-means and only scores the clusters closest to the
+query, which trades a little recall for much less work on large knowledge
+bases. Both return the top k rows with their scores, best first.
+
+DeltaIndex puts either in front of an exact delta segment, so rows can be
+added while serving and merged into a rebuilt base later.
+"""
+import threading
+import numpy as np
+
+def normalize_rows(vectors):
+    """Return float32 rows scaled to unit L2 norm, all-zero rows stay zero."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def top_k(scores, k):
+    """Indices and values of the k largest scores of every row, best first."""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+class ExactIndex:
+    """Brute-force search over pre-normalized float32 vectors."""
+
+    def __init__(self, vectors, normalized=False):
+        # Normalized input is kept as is, so a memory-mapped matrix stays shared
+        self.vectors = vectors if normalized else normalize_rows(vectors)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def search(self, queries, k=1):
+        """Return (indices, scores) arrays of shape (n_queries, k)."""
+        scores = normalize_rows(queries) @ self.vectors.T
+        return top_k(scores, k)
+
+class IVFIndex:
+    """Inverted-file index with a spherical k-means coarse quantizer.
+
+    Rows are stored grouped by cluster. A query scores the centroids, then
+    only the rows of its n_probe closest clusters (more if those hold fewer
+    than k rows).
+    """
+
+    def __init__(self, vectors, n_lists=None, n_probe=16, n_iter=10, sample_size=50000, seed=0, normalized=False):
+        vectors = vectors if normalized else normalize_rows(vectors)
+        n_rows = vectors.shape[0]
+        self.n_lists = max(1, min(n_lists or int(np.sqrt(n_rows)), n_rows))
+        self.n_probe = min(n_probe, self.n_lists)
+        self.centroids = self._train(vectors, n_iter, sample_size, np.random.default_rng(seed))
+
+        assignments = self._assign(vectors)
+        self.ids = np.argsort(assignments, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[self.ids])
+        counts = np.bincount(assignments, minlength=self.n_lists)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def _assign(self, vectors, chunk_size=65536):
+        assignments = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = np.asarray(vectors[start:start + chunk_size])
+            assignments[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train(self, vectors, n_iter, sample_size, rng):
+        n_rows = vectors.shape[0]
+        sample = np.asarray(vectors[np.sort(rng.choice(n_rows, size=min(sample_size, n_rows), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=self.n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=self.n_lists) == 0
+            # Reseed empty clusters from random sample rows
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def search(self, queries, k=1):
+        """Return (indices, scores) arrays of shape (n_queries, k)."""
+        queries = normalize_rows(queries)
+        k = min(k, len(self))
+        list_order = np.argsort(-(queries @ self.centroids.T), axis=1)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        sizes = np.diff(self.offsets)
+        for row, lists in enumerate(list_order):
+            n_probe = self.n_probe
+            while sizes[lists[:n_probe]].sum() < k:
+                n_probe += 1
+            candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists[:n_probe]])
+            best, best_scores = top_k((self.vectors[candidates] @ queries[row])[None, :], k)
+            indices[row] = self.ids[candidates[best[0]]]
+            scores[row] = best_scores[0]
+        return indices, scores
+
+class DeltaIndex:
+    """A base index plus an exactly searched segment of rows added since it was built.
+
+    `build` turns a row matrix into the base index, compact() calls it on
+    the base rows followed by the delta rows. Row numbers never change.
+    """
+
+    def __init__(self, vectors, build, normalized=False):
+        vectors = vectors if normalized else normalize_rows(vectors)
+        self.build = build
+        # Read once per search, so a concurrent add or compaction is seen whole
+        self._segments = (build(vectors), vectors, np.empty((0, vectors.shape[1]), dtype=np.float32))
+        self._write_lock = threading.Lock()
+
+    def __len__(self):
+        _, vectors, delta = self._segments
+        return vectors.shape[0] + delta.shape[0]
+
+    @property
+    def n_delta(self):
+        return self._segments[2].shape[0]
+
+    def add(self, vectors):
+        """Append rows, numbered after the existing ones."""
+        vectors = normalize_rows(vectors)
+        with self._write_lock:
+            base, base_vectors, delta = self._segments
+            self._segments = (base, base_vectors, np.vstack([delta, vectors]))
+
+    def search(self, queries, k=1):
+        """Return (indices, scores) arrays of shape (n_queries, k)."""
+        base, base_vectors, delta = self._segments
+        indices, scores = base.search(queries, k=k)
+        if not delta.shape[0]:
+            return indices, scores
+        delta_scores = normalize_rows(queries) @ delta.T
+        delta_indices = np.broadcast_to(np.arange(base_vectors.shape[0], base_vectors.shape[0] + delta.shape[0]),
+                                        delta_scores.shape)
+        best, best_scores = top_k(np.hstack([scores, delta_scores]), k)
+        return np.take_along_axis(np.hstack([indices, delta_indices]), best, axis=1), best_scores
+
+    def compact(self):
+        """Rebuild the base index over every row, off the search path."""
+        _, base_vectors, delta = self._segments
+        if not delta.shape[0]:
+            return
+        vectors = np.vstack([base_vectors, delta])
+        base = self.build(vectors)
+        with self._write_lock:
+            # Rows added during the rebuild stay in the delta
+            current_delta = self._segments[2]
+            self._segments = (base, vectors, current_delta[delta.shape[0]:])
+
+def build_vector_index(vectors, backend="auto", normalized=False, ivf_min_rows=100000, **ivf_options):
+    """Pick the exact backend for small matrices and IVF from ivf_min_rows rows."""
+    if backend == "auto":
+        backend = "ivf" if vectors.shape[0] >= ivf_min_rows else "exact"
+    if backend == "exact":
+        return ExactIndex(vectors, normalized=normalized)
+    if backend == "ivf":
+        return IVFIndex(vectors, normalized=normalized, **ivf_options)
+    raise ValueError(f"Unknown vector index backend: {backend}")
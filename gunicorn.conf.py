@@ -0,0 +1,39 @@
+"""Gunicorn settings for serving the app on every core, see wsgi.py.
+
+WEB_CONCURRENCY sets the number of worker processes, one per core by
+default, and GUNICORN_THREADS the threads of each, which wait on the
+external API and on streamed answers. Metrics are summed over the
+workers through files in METRICS_DIR, a new temporary directory unless set.
+"""
+import gc
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+# Streamed answers can take as long as the external API
+timeout = 120
+# Load the models in the master, the workers share its memory pages
+preload_app = True
+# Read by chatbot.config, so set before the app is loaded
+if not os.getenv('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='isbot-metrics-')
+
+def on_starting(server):
+    from chatbot.metrics import clear_shared_metrics
+    clear_shared_metrics(os.environ['METRICS_DIR'])
+
+def on_exit(server):
+    from chatbot.metrics import clear_shared_metrics
+    clear_shared_metrics(os.environ['METRICS_DIR'])
+
+def pre_fork(server, worker):
+    # Keep the collector from touching, and so copying, the objects loaded before the fork
+    gc.freeze()
+
+def post_fork(server, worker):
+    from app import start_worker
+    start_worker(server.app.wsgi())
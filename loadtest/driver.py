@@ -0,0 +1,193 @@
+"""Replay question mixes against a running app at a target request rate.
+
+Start the mock API and the app, with the load-test login enabled:
+
+    python -m loadtest.mock_openrouter --latency-ms 800
+    LOADTEST_LOGIN=1 OPENROUTER_API_URL=http://127.0.0.1:8999/v1/chat/completions python app.py
+
+then drive it:
+
+    python -m loadtest.driver --base-url http://127.0.0.1:8080 --users 50 --rate 20 --duration 60
+
+Each virtual user logs in through /loadtest/login and opens a chat session.
+Requests are sent open-loop: request i is due at start + i / rate whatever
+the app's speed, and its latency counts from that due time, so a saturated
+app shows up as growing latency instead of a silently lower rate. A request
+is an error on a non-2xx status, a network error, or a stream without its
+"done" event. Throughput, error rate and latency percentiles are reported
+overall and per endpoint.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from chatbot.config import shortcuts, DATA_PATH, LOADTEST_EMAIL_DOMAIN
+
+def parse_weights(text):
+    """Parse "a=0.5,b=0.5" into a dict of weights."""
+    weights = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+def load_questions(data_path):
+    with open(data_path, encoding='utf-8') as f:
+        entries = json.load(f)
+    questions = []
+    for entry in entries:
+        questions.append(entry['question'])
+        questions.extend(entry.get('question_variations') or [])
+    return questions
+
+class VirtualUser:
+    def __init__(self, base_url, index, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.http = requests.Session()
+        response = self.http.post(f"{base_url}/loadtest/login", json={"email": f"student{index}@{LOADTEST_EMAIL_DOMAIN}"},
+                                  timeout=timeout)
+        response.raise_for_status()
+        response = self.http.post(f"{base_url}/new_chat", timeout=timeout)
+        response.raise_for_status()
+        self.session_id = response.json()['session_id']
+
+    def chat(self, question):
+        response = self.http.post(f"{self.base_url}/", params={'session_id': self.session_id},
+                                  data={'message': question}, timeout=self.timeout)
+        return response.ok, response.status_code
+
+    def stream(self, question):
+        response = self.http.post(f"{self.base_url}/chat/stream", params={'session_id': self.session_id},
+                                  data={'message': question}, timeout=self.timeout, stream=True)
+        with response:
+            body = b''.join(response.iter_content(chunk_size=None))
+        return response.ok and b'event: done' in body, response.status_code
+
+    def batch(self, questions):
+        response = self.http.post(f"{self.base_url}/api/chat/batch", json={'queries': questions},
+                                  timeout=self.timeout)
+        return response.ok, response.status_code
+
+    def history(self, _question):
+        response = self.http.get(f"{self.base_url}/api/sessions/{self.session_id}/messages", timeout=self.timeout)
+        return response.ok, response.status_code
+
+class QuestionMix:
+    """Draws knowledge-base questions, shortcuts and off-topic questions in the given proportions."""
+    def __init__(self, weights, kb_questions, rng):
+        self.kinds = list(weights)
+        self.weights = [weights[kind] for kind in self.kinds]
+        self.kb_questions = kb_questions
+        self.shortcuts = list(shortcuts)
+        self.rng = rng
+
+    def draw(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'kb':
+            return kind, self.rng.choice(self.kb_questions)
+        if kind == 'shortcut':
+            return kind, self.rng.choice(self.shortcuts)
+        # Made-up words, so neither saved questions nor the answer cache absorb it
+        words = ("".join(self.rng.choice("bcdfglmnprstvz") + self.rng.choice("aeiou") for _ in range(3))
+                 for _ in range(4))
+        return kind, " ".join(words)
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(records, elapsed):
+    ok = [r for r in records if r["ok"]]
+    latencies = [r["latency_ms"] for r in ok]
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "error_rate": (len(records) - len(ok)) / len(records) if records else 0.0,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": max(latencies) if latencies else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:8080')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=10, help="requests per second")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of load")
+    parser.add_argument('--concurrency', type=int, default=256, help="requests in flight at most")
+    parser.add_argument('--mix', default='kb=0.6,shortcut=0.2,external=0.2', help="question kinds and weights")
+    parser.add_argument('--endpoints', default='chat=0.5,stream=0.2,batch=0.1,history=0.2',
+                        help="endpoints and weights, among chat, stream, batch and history")
+    parser.add_argument('--batch-size', type=int, default=10, help="questions per /api/chat/batch call")
+    parser.add_argument('--data', default=DATA_PATH, help="knowledge base the kb questions come from")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    mix = QuestionMix(parse_weights(args.mix), load_questions(args.data), rng)
+    endpoint_weights = parse_weights(args.endpoints)
+    endpoints, weights = list(endpoint_weights), list(endpoint_weights.values())
+    print(f"Logging in {args.users} users...")
+    users = [VirtualUser(args.base_url, i, args.timeout) for i in range(args.users)]
+
+    records = []
+    records_lock = threading.Lock()
+
+    def send(due, user, endpoint, kind, question):
+        try:
+            if endpoint == 'batch':
+                ok, status = user.batch([question] + [mix.draw()[1] for _ in range(args.batch_size - 1)])
+            else:
+                ok, status = getattr(user, endpoint)(question)
+        except requests.RequestException as e:
+            ok, status = False, type(e).__name__
+        record = {"endpoint": endpoint, "kind": kind, "ok": ok, "status": status,
+                  "latency_ms": (time.perf_counter() - due) * 1000}
+        with records_lock:
+            records.append(record)
+
+    total = int(args.rate * args.duration)
+    print(f"Sending {total} requests at {args.rate}/s...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for i in range(total):
+            due = started + i / args.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            kind, question = mix.draw()
+            executor.submit(send, due, rng.choice(users), rng.choices(endpoints, weights)[0], kind, question)
+    elapsed = time.perf_counter() - started
+
+    results = {
+        "base_url": args.base_url, "users": args.users, "target_rps": args.rate, "duration_s": args.duration,
+        "elapsed_s": elapsed, "overall": summarize(records, elapsed),
+        "endpoints": {endpoint: summarize([r for r in records if r["endpoint"] == endpoint], elapsed)
+                      for endpoint in endpoints},
+        "statuses": {}
+    }
+    for record in records:
+        results["statuses"][str(record["status"])] = results["statuses"].get(str(record["status"]), 0) + 1
+
+    print(f"{'endpoint':<10}{'requests':>9}{'errors':>8}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, stats in [("overall", results["overall"])] + list(results["endpoints"].items()):
+        row = [stats[key] if stats[key] is not None else float('nan') for key in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:<10}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput_rps']:>8.1f}"
+              f"{row[0]:>9.0f}{row[1]:>9.0f}{row[2]:>9.0f}")
+    print(f"statuses: {results['statuses']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Local stand-in for the OpenRouter chat-completions API.
+
+    python -m loadtest.mock_openrouter --port 8999 --latency-ms 800 --token-delay-ms 30
+
+Point the app at it before starting it:
+
+    OPENROUTER_API_URL=http://127.0.0.1:8999/v1/chat/completions python app.py
+
+Plain requests get the whole completion after --latency-ms (plus up to
+--jitter-ms). Requests with "stream": true get it as Server-Sent Events,
+the first chunk after --latency-ms and one word every --token-delay-ms, like
+OpenRouter including its keep-alive comment. --error-rate answers that share
+of the requests with a 502. --gzip compresses the plain answers for the
+clients that accept it, as a proxy in front of the API may.
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("Voici une réponse simulée du modèle externe. Elle contient assez de mots pour que la "
+          "diffusion en continu dure un moment, comme une vraie réponse générée.")
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this delayed ACKs add 40 ms
+    disable_nagle_algorithm = True
+    latency = 0.0
+    jitter = 0.0
+    token_delay = 0.0
+    error_rate = 0.0
+    gzip = False
+    requests_served = 0
+    _count_lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with self._count_lock:
+            MockHandler.requests_served += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        if random.random() < self.error_rate:
+            self._send_json(502, {"error": {"message": "mock upstream error", "code": 502}})
+        elif body.get('stream'):
+            self._stream()
+        else:
+            self._send_json(200, {"choices": [{"message": {"role": "assistant", "content": ANSWER}}]})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._chunk(': OPENROUTER PROCESSING\n\n')
+        for i, word in enumerate(ANSWER.split(' ')):
+            if i:
+                time.sleep(self.token_delay)
+            chunk = {"choices": [{"delta": {"content": word if i == 0 else ' ' + word}}]}
+            self._chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+def serve(host='127.0.0.1', port=8999, latency_ms=800, jitter_ms=0, token_delay_ms=30, error_rate=0.0,
+          gzip=False):
+    """Start the mock on a background thread; return the server, whose server_port is bound."""
+    MockHandler.latency = latency_ms / 1000
+    MockHandler.jitter = jitter_ms / 1000
+    MockHandler.token_delay = token_delay_ms / 1000
+    MockHandler.error_rate = error_rate
+    MockHandler.gzip = gzip
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openrouter", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency-ms', type=float, default=800, help="delay before the answer or first chunk")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="random extra delay, up to this much")
+    parser.add_argument('--token-delay-ms', type=float, default=30, help="delay between streamed words")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with a 502")
+    parser.add_argument('--gzip', action='store_true', help="gzip the plain answers when accepted")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.latency_ms, args.jitter_ms, args.token_delay_ms, args.error_rate,
+                   args.gzip)
+    print(f"Mock OpenRouter on http://{args.host}:{server.server_port}/v1/chat/completions")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"{MockHandler.requests_served} requests served")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
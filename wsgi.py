@@ -0,0 +1,11 @@
+"""Production entry point for a pre-forking WSGI server:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app, the knowledge snapshot and the trained models are loaded here once,
+in the master with preload_app, and shared copy-on-write by the workers,
+which start their own connections and threads in post_fork.
+"""
+from app import create_app
+
+app = create_app(start=False)